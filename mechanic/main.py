@@ -1,9 +1,11 @@
 """mechanic code generator from an OpenAPI 3.0 specification file.
 
 Usage:
-    mechanic build <directory>
-    mechanic merge <master> <files>...
+    mechanic build <directory> [--incremental] [--jobs=<n>] [--emit-ir] [--profile] [--profile-schemas=<n>]
+    mechanic watch <directory> [--jobs=<n>] [--interval=<seconds>]
+    mechanic merge <master> <files>... [--jobs=<n>] [--keep-artifacts] [--compact] [--incremental]
     mechanic generate (model|schema|controller|versions) <object_path> <output_file> [--filter-tag=<tag>...] [--exclude-tag=<tag>...]
+    mechanic generate <object_path> --jobs-file=<file> [--filter-tag=<tag>...] [--exclude-tag=<tag>...]
 
 Note:
     - 'mechanic generate' is experimental, use with caution
@@ -14,225 +16,122 @@ Arguments:
 Options:
     -h --help                           Show this screen
     -v --version                        Show version
+    -j <n> --jobs=<n>                   Number of worker processes to build or merge with [default: 1]
+    --keep-artifacts                    Keep the merged copy of each input spec in tmp_merged_specs/
+    --compact                           Write json output without indentation
+    --incremental                       Only build (or merge) what changed since the last incremental run
+    --emit-ir                           Write the compiled mechanic object to mech-compiled.yaml
+    --profile                           Write a report of where build time went to mechanic-profile.json
+    --profile-schemas=<n>               Number of slowest schemas in the profile, 0 for all of them [default: 10]
+    --interval=<seconds>                Seconds between checks for changed files [default: 0.5]
+    --jobs-file=<file>                  Json or yaml list of files to generate from one merge of the spec
 
 Examples:
     mechanic build .
+    mechanic watch .
 """
 # native python
 import os
-import pkg_resources
-import datetime
 
 # third party
 from docopt import docopt
 
-# project
-from mechanic.src.compiler import Compiler, Merger, MECHANIC_SUPPORTED_HTTP_METHODS
-from mechanic.src.generator import Generator
-from mechanic.src.merger import SpecMerger
-from mechanic.src.reader import read_mechanicfile
+# project modules are imported by the command that needs them, so that e.g. 'mechanic merge' does not pay for importing
+# the compiler and generator.
 
+PROFILE_OUTPUT = 'mechanic-profile.json'
 
-def _render(tpl_path, context):
-    path, filename = os.path.split(tpl_path)
-    import jinja2
-    return jinja2.Environment(loader=jinja2.FileSystemLoader(path or './')).get_template(filename).render(
-        context)
+
+def _resource_filename(path):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+
+def _find_mechanicfile(directory):
+    filepath = directory + '/mechanic.json'
+    if not os.path.exists(filepath):
+        filepath = directory + '/mechanic.yaml'
+    return filepath
 
 
 def main():
-    with open(pkg_resources.resource_filename(__name__, 'VERSION')) as version_file:
+    with open(_resource_filename('VERSION')) as version_file:
         current_version = version_file.read().strip()
 
     args = docopt(__doc__, version=current_version)
 
     if args['build']:
+        from mechanic.src.compiler import Compiler, DEFAULT_OUTPUT
+        from mechanic.src.generator import Generator
+        from mechanic.src.profiler import Profiler
+        from mechanic.src.reader import read_mechanicfile
+
+        profiler = Profiler(top_schemas=int(args['--profile-schemas'])) if args['--profile'] else None
         directory = os.path.expanduser(args['<directory>'])
-        filepath = directory + '/mechanic.json'
-        try:
-            mechanic_options = read_mechanicfile(filepath)
-        except FileNotFoundError:
-            filepath = directory + '/mechanic.yaml'
-            mechanic_options = read_mechanicfile(filepath)
-        compiler = Compiler(mechanic_options, mechanic_file_path=filepath)
+        filepath = _find_mechanicfile(directory)
+        mechanic_options = read_mechanicfile(filepath)
+        compiler = Compiler(mechanic_options,
+                            mechanic_file_path=filepath,
+                            output=DEFAULT_OUTPUT if args['--emit-ir'] else None,
+                            incremental=args['--incremental'],
+                            jobs=int(args['--jobs']),
+                            profiler=profiler)
         compiler.compile()
-        Generator(directory, compiler.mech_obj, options=mechanic_options).generate()
+        generator = Generator(directory,
+                              compiler.mech_obj,
+                              options=mechanic_options,
+                              oapi_obj=compiler.oapi_obj,
+                              profiler=profiler,
+                              jobs=int(args['--jobs']))
+        generator.generate()
+
+        written = generator.count_written_files()
+        print('%d files written, %d unchanged' % (written, len(generator.file_changes) - written))
+
+        if profiler:
+            profiler.info['mechanic_version'] = current_version
+            profiler.write(PROFILE_OUTPUT)
+    elif args['watch']:
+        from mechanic.src.watcher import Watcher
+
+        directory = os.path.expanduser(args['<directory>'])
+        watcher = Watcher(directory,
+                          _find_mechanicfile(directory),
+                          jobs=int(args['--jobs']),
+                          interval=float(args['--interval']))
+        print('Watching %s for changes, press Ctrl+C to stop' % directory)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
     elif args['merge']:
+        from mechanic.src.merger import SpecMerger
+
         files_to_merge = args['<files>']
-        spec_merger = SpecMerger(files_to_merge, args['<master>'])
+        spec_merger = SpecMerger(files_to_merge,
+                                 args['<master>'],
+                                 jobs=int(args['--jobs']),
+                                 keep_artifacts=args['--keep-artifacts'],
+                                 compact=args['--compact'],
+                                 incremental=args['--incremental'])
         spec_merger.merge()
     elif args['generate']:
-        context = {
-            'timestamp': datetime.datetime.utcnow(),
-            'codeblocks': []
-        }
-        # if object_path is file, generate all of 'type' (e.g. 'model', 'schema', 'controller')
-        if args['<object_path>'].endswith('.yaml') \
-                or args['<object_path>'].endswith('.yml') \
-                or args['<object_path>'].endswith('.json'):
-            # merge oapi file
-            oapi_file = args['<object_path>']
-            merger = Merger(oapi_file, 'temp.yaml')
-            merger.merge()
-            os.remove('temp.yaml')
-
-            oapi_obj = merger.oapi_obj
-            oapi_version = oapi_obj.get('info', {}).get('version', '0.0.1')
-
-            filter_tags = args['--filter-tag']
-            exclude_tags = args['--exclude-tag']
-
-            filter_tag_set = set(args['--filter-tag'])
-            exclude_tag_set = set(args['--exclude-tag'])
-
-            if args['model']:
-                # first generate any additional tables from components.x-mechanic-db-tables
-                for table_name, table_def in oapi_obj['components'].get('x-mechanic-db-tables', {}).items():
-                    s2 = set(table_def.get('x-mechanic-tags', []))
-
-                    if not exclude_tag_set.intersection(s2) and filter_tag_set <= s2 or len(filter_tags) == 0:
-                        context['codeblocks'].append({
-                            'type': 'table',
-                            'table_name': table_name,
-                            'oapi': oapi_obj['components']['x-mechanic-db-tables'][table_name]
-                        })
-
-                # next generate models from components.schemas
-                for model_name, model in oapi_obj['components']['schemas'].items():
-                    if model.get('allOf'):
-                        allof_refs = []
-                        # first assign 'model' to actual schema data, not the allOf ref
-                        for item in model.get('allOf'):
-                            if not item.get('$ref'):
-                                model = item
-                            else:
-                                allof_refs.append(item.get('$ref'))
-
-                        for allof_ref in allof_refs:
-                            obj, obj_name = merger.follow_reference_link(allof_ref)
-                            for prop_name, prop_obj in obj.get('properties').items():
-                                model['properties'][prop_name] = prop_obj
-                                if model.get('required'):
-                                    model['required'].extend(obj.get('required', []))
-
-                    # get tags for filtering code generation
-                    s2 = set(model.get('x-mechanic-tags', []))
-
-                    if not exclude_tag_set.intersection(s2) and filter_tag_set <= s2 or len(filter_tags) == 0:
-                        if model.get('x-mechanic-model', {}).get('generate'):
-                            context['codeblocks'].append({
-                                'type': 'model',
-                                'class_name': model.get('x-mechanic-model', {}).get('class_name', model_name),
-                                'base_class_name': model.get('x-mechanic-model', {}).get('base_class', 'db.Model'),
-                                'version': model.get('x-mechanic-version', oapi_version),
-                                'oapi': model,
-                            })
-            elif args['schema']:
-                for model_name, model in oapi_obj['components']['schemas'].items():
-                    if model.get('allOf'):
-                        allof_refs = []
-                        # first assign 'model' to actual schema data, not the allOf ref
-                        for item in model.get('allOf'):
-                            if not item.get('$ref'):
-                                model = item
-                            else:
-                                allof_refs.append(item.get('$ref'))
-
-                        for allof_ref in allof_refs:
-                            obj, obj_name = merger.follow_reference_link(allof_ref)
-                            for prop_name, prop_obj in obj.get('properties').items():
-                                model['properties'][prop_name] = prop_obj
-                                if model.get('required'):
-                                    model['required'].extend(obj.get('required', []))
-
-                    s2 = set(model.get('x-mechanic-tags', []))
-
-                    if not exclude_tag_set.intersection(s2) and filter_tag_set <= s2 or len(
-                            filter_tags) == 0:
-                        context['codeblocks'].append({
-                            'type': 'schema',
-                            'class_name': model.get('x-mechanic-schema', {}).get('class_name', model_name + 'Schema'),
-                            'base_class_name': model.get('x-mechanic-schema', {}).get('base_class', 'ma.ModelSchema'),
-                            'version': model.get('x-mechanic-version', oapi_version),
-                            'oapi': model,
-                        })
-            elif args['controller']:
-                for path_name, path in oapi_obj['paths'].items():
-                    if path.get('x-mechanic-controller'):
-                        model = path.get('x-mechanic-controller').get('model')
-                        schema = path.get('x-mechanic-controller').get('schema')
-                        path_version = path.get('x-mechanic-version', oapi_version)
-
-                        if not oapi_obj['paths'][path_name]['x-mechanic-controller'].get('responses'):
-                            oapi_obj['paths'][path_name]['x-mechanic-controller']['responses'] = dict()
-                        if not oapi_obj['paths'][path_name]['x-mechanic-controller'].get('requests'):
-                            oapi_obj['paths'][path_name]['x-mechanic-controller']['requests'] = dict()
-                        oapi_responses = oapi_obj['paths'][path_name]['x-mechanic-controller']['responses']
-                        oapi_requests = oapi_obj['paths'][path_name]['x-mechanic-controller']['requests']
-
-                        for method_name, method in path.items():
-                            if method_name in MECHANIC_SUPPORTED_HTTP_METHODS:
-                                if not oapi_responses.get(method_name):
-                                    oapi_responses[method_name] = dict()
-
-                                oapi_responses[method_name]['model'] = model
-                                oapi_responses[method_name]['schema'] = schema
-
-                                for response_code, response_obj in method.get('responses', {}).items():
-                                    if response_code.startswith('2'):
-                                        oapi_responses[method_name]['code'] = response_code
-
-                                if method.get('requestBody'):
-                                    if not oapi_requests.get(method_name):
-                                        oapi_requests[method_name] = dict()
-
-                                    oapi_requests[method_name]['model'] = model
-                                    oapi_requests[method_name]['schema'] = schema
-
-                        # get tags for filtering code generation
-                        s2 = set(path.get('x-mechanic-tags', []))
-
-                        if not exclude_tag_set.intersection(s2) and filter_tag_set <= s2 or len(filter_tags) == 0:
-                            context['codeblocks'].append({
-                                'type': 'controller',
-                                'class_name': path['x-mechanic-controller']['class_name'],
-                                'base_class_name': path['x-mechanic-controller']['base_class_name'],
-                                'version': path.get('x-mechanic-version', oapi_version),
-                                'oapi': oapi_obj['paths'][path_name],
-                            })
-            elif args['versions']:
-                controllers = []
-
-                for path_name, path in oapi_obj['paths'].items():
-                    if path.get('x-mechanic-controller'):
-                        controllers.append(path['x-mechanic-controller'])
-
-                context['codeblocks'].append({
-                    'type': 'versions',
-                    'controllers': controllers
-                })
-
-        # if object_path is oapi object, generate for 'type'
-        result = _render(pkg_resources.resource_filename(__name__, 'templates/code.tpl'), context=context)
-
-        mechanic_save_block = None
-        try:
-            with open(args['<output_file>'], 'r') as f:
-                current_contents = f.read()
-                if len(current_contents.split('# END mechanic save #')) >= 2:
-                    mechanic_save_block = current_contents.split('# END mechanic save #')[0]
-        except FileNotFoundError:
-            # file doesn't exist, create it below
-            pass
-
-        with open(args['<output_file>'], 'w') as f:
-            if not mechanic_save_block:
-                f.write(result)
-            else:
-                f.write(mechanic_save_block)
-                mechanic_modify_block = result.split('# END mechanic save #')[1]
-                f.write('# END mechanic save #')
-                f.write(mechanic_modify_block)
+        from mechanic.src.codegen import CodeGenerator, read_jobs_file
+
+        if args['--jobs-file']:
+            jobs = read_jobs_file(args['--jobs-file'],
+                                  filter_tags=args['--filter-tag'],
+                                  exclude_tags=args['--exclude-tag'])
+        else:
+            gen_type = [t for t in ['model', 'schema', 'controller', 'versions'] if args[t]][0]
+            jobs = [{
+                'type': gen_type,
+                'output_file': args['<output_file>'],
+                'filter_tags': args['--filter-tag'],
+                'exclude_tags': args['--exclude-tag'],
+            }]
+
+        # the spec is merged once for all jobs
+        CodeGenerator(args['<object_path>']).generate(jobs)
 
 
 if __name__ == '__main__':
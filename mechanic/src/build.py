@@ -0,0 +1,37 @@
+"""
+Python API to compile a spec and generate an app in memory, without writing the merged spec, the compiled mechanic
+object or the generated files to disk.
+"""
+from mechanic.src import reader
+from mechanic.src.compiler import Compiler
+from mechanic.src.generator import Generator
+
+
+def compile_spec(oapi_obj, options, jobs=1):
+    """
+    Compiles an OpenAPI 3.0 spec into the mechanic object.
+    :param oapi_obj: dictionary representation of the spec, it is merged in place. External references are resolved
+    relative to the OPENAPI option if it is set, otherwise relative to the current directory.
+    :param options: dictionary of mechanic file options, defaults are filled in for options that are not set
+    :param jobs: number of worker processes to compile with
+    :return: the mechanic object
+    """
+    compiler = Compiler(reader.get_options(options), jobs=jobs, oapi_obj=oapi_obj)
+    return compiler.compile()
+
+
+def generate(oapi_obj, options, jobs=1):
+    """
+    Compiles an OpenAPI 3.0 spec and renders the files of the generated app.
+    :param oapi_obj: dictionary representation of the spec, see compile_spec
+    :param options: dictionary of mechanic file options, see compile_spec
+    :param jobs: number of worker processes to compile and render with
+    :return: the mechanic object, and a dictionary of path (relative to the app directory) to file contents
+    """
+    options = reader.get_options(options)
+    compiler = Compiler(options, jobs=jobs, oapi_obj=oapi_obj)
+    mech_obj = compiler.compile()
+
+    generator = Generator(None, mech_obj, options=options, oapi_obj=compiler.oapi_obj, jobs=jobs)
+    generator.generate()
+    return mech_obj, generator.files
@@ -0,0 +1,73 @@
+import os
+from collections import OrderedDict
+
+import mechanic.src.utils as utils
+
+DEFAULT_MAX_DOCUMENTS = 256
+
+
+class DocumentCache(object):
+    """
+    Keeps parsed json/yaml documents in memory for the duration of a run, so a file that is referenced many times is
+    only read and parsed once. Entries are keyed by the resolved path and modification time of the file, so an edited
+    file is parsed again. When more than max_size documents are held, the least recently used one is evicted.
+
+    Documents are shared between callers, so callers that modify what they get back must copy it first.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_DOCUMENTS):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._documents = OrderedDict()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def load(self, file_path):
+        """
+        Gets the parsed contents of a file, parsing it only if it is not already cached.
+        :param file_path: path to a json or yaml file
+        :return: dictionary representation of the file
+        """
+        path = os.path.realpath(file_path)
+        mtime = os.stat(path).st_mtime_ns
+        entry = self._documents.get(path)
+
+        if entry and entry[0] == mtime:
+            self.hits += 1
+            self._documents.move_to_end(path)
+            return entry[1]
+
+        self.misses += 1
+        data = utils.deserialize_file(path)
+        self._store(path, mtime, data)
+        return data
+
+    def put(self, file_path, data):
+        """
+        Adds a document that was parsed elsewhere, e.g. in a worker process.
+        :param file_path: path to the file that data was parsed from
+        :param data: dictionary representation of the file
+        """
+        path = os.path.realpath(file_path)
+        self._store(path, os.stat(path).st_mtime_ns, data)
+
+    def _store(self, path, mtime, data):
+        self._documents[path] = (mtime, data)
+        self._documents.move_to_end(path)
+
+        while len(self._documents) > self.max_size:
+            self._documents.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._documents.clear()
+
+    def stats(self):
+        return {
+            "documents": len(self._documents),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,251 @@
+# native python
+import datetime
+import os
+from collections import OrderedDict
+
+# project
+from mechanic.src import templates
+from mechanic.src.compiler import MECHANIC_SUPPORTED_HTTP_METHODS
+from mechanic.src.merger import Merger
+import mechanic.src.utils as utils
+
+CODE_TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates", "code.tpl")
+GENERATE_TYPES = ["model", "schema", "controller", "versions"]
+MECHANIC_SAVE_MARKER = "# END mechanic save #"
+
+
+def read_jobs_file(file_path, filter_tags=None, exclude_tags=None):
+    """
+    Reads a json or yaml file that lists the files to generate, e.g.:
+
+    [
+        {"type": "model", "output_file": "models.py", "filter_tags": ["store"]},
+        {"type": "schema", "output_file": "schemas.py"}
+    ]
+
+    :param file_path: path of the jobs file
+    :param filter_tags: tags to filter by for jobs that do not set their own "filter_tags"
+    :param exclude_tags: tags to exclude for jobs that do not set their own "exclude_tags"
+    :return: list of jobs, each a dictionary with "type", "output_file", "filter_tags" and "exclude_tags"
+    """
+    jobs = utils.deserialize_file(file_path)
+    if not isinstance(jobs, list):
+        raise SyntaxError("Jobs file %s must be a list of jobs" % file_path)
+
+    for job in jobs:
+        if not isinstance(job, dict) or job.get("type") not in GENERATE_TYPES or not job.get("output_file"):
+            raise SyntaxError("Invalid job %s in %s, each job needs a 'type' (one of %s) and an 'output_file'"
+                              % (job, file_path, ", ".join(GENERATE_TYPES)))
+        job.setdefault("filter_tags", list(filter_tags or []))
+        job.setdefault("exclude_tags", list(exclude_tags or []))
+    return jobs
+
+
+class CodeGenerator(object):
+    """
+    Generates standalone python files of models, schemas, controllers or versions from an OpenAPI spec, as used by
+    'mechanic generate'. Several files can be generated from the same spec in one run: the spec is merged once, the
+    allOf schemas are flattened once, and all files share the jinja environment of the process and one timestamp.
+
+    If oapi_file is not a json or yaml file, the generated files have no code blocks.
+
+    If an output file already exists, everything above its '# END mechanic save #' line is kept.
+    """
+    def __init__(self, oapi_file):
+        self.oapi_file = oapi_file
+        self.timestamp = datetime.datetime.utcnow()
+        self.merger = None
+        self.oapi_obj = None
+        self._schemas = None
+
+        if oapi_file.endswith(".yaml") or oapi_file.endswith(".yml") or oapi_file.endswith(".json"):
+            self.merger = Merger(oapi_file, None)
+            self.merger.merge()
+            self.oapi_obj = self.merger.oapi_obj
+
+    def generate(self, jobs):
+        """
+        Generates a file for each job.
+        :param jobs: list of dictionaries with "type", "output_file", "filter_tags" and "exclude_tags" (see
+        read_jobs_file)
+        """
+        for job in jobs:
+            result = self.render(job["type"], job.get("filter_tags"), job.get("exclude_tags"))
+            self.write(job["output_file"], result)
+
+    def render(self, gen_type, filter_tags=None, exclude_tags=None):
+        """
+        :param gen_type: one of 'model', 'schema', 'controller' or 'versions'
+        :param filter_tags: only generate objects that have all of these x-mechanic-tags
+        :param exclude_tags: do not generate objects that have any of these x-mechanic-tags
+        :return: the generated code
+        """
+        context = {
+            "timestamp": self.timestamp,
+            "codeblocks": self.get_codeblocks(gen_type, filter_tags or [], exclude_tags or [])
+        }
+        return templates.render(CODE_TEMPLATE, context)
+
+    def get_codeblocks(self, gen_type, filter_tags, exclude_tags):
+        """
+        :return: list of code blocks the code template renders for gen_type
+        """
+        if self.oapi_obj is None:
+            return []
+
+        getter = {
+            "model": self._get_model_codeblocks,
+            "schema": self._get_schema_codeblocks,
+            "controller": self._get_controller_codeblocks,
+            "versions": self._get_versions_codeblocks,
+        }[gen_type]
+        return getter(filter_tags, exclude_tags)
+
+    def write(self, output_file, result):
+        """
+        Writes generated code to a file, keeping everything above the '# END mechanic save #' line of the existing file.
+        """
+        mechanic_save_block = None
+        try:
+            with open(output_file, "r") as f:
+                current_contents = f.read()
+                if len(current_contents.split(MECHANIC_SAVE_MARKER)) >= 2:
+                    mechanic_save_block = current_contents.split(MECHANIC_SAVE_MARKER)[0]
+        except FileNotFoundError:
+            # file doesn't exist, create it below
+            pass
+
+        with open(output_file, "w") as f:
+            if not mechanic_save_block:
+                f.write(result)
+            else:
+                f.write(mechanic_save_block)
+                mechanic_modify_block = result.split(MECHANIC_SAVE_MARKER)[1]
+                f.write(MECHANIC_SAVE_MARKER)
+                f.write(mechanic_modify_block)
+
+    def _is_included(self, obj, filter_tags, exclude_tags):
+        tags = set(obj.get("x-mechanic-tags", []))
+        return not set(exclude_tags).intersection(tags) and set(filter_tags) <= tags or len(filter_tags) == 0
+
+    def _get_version(self):
+        return self.oapi_obj.get("info", {}).get("version", "0.0.1")
+
+    def _get_schemas(self):
+        """
+        Flattens each schema that uses allOf into the schema it defines itself, with the properties of the schemas it
+        references added. This changes the spec, so it is only done once per run.
+        :return: dictionary of schema name to schema
+        """
+        if self._schemas is None:
+            self._schemas = OrderedDict()
+            for model_name, model in self.oapi_obj["components"]["schemas"].items():
+                if model.get("allOf"):
+                    allof_refs = []
+                    # first assign 'model' to actual schema data, not the allOf ref
+                    for item in model.get("allOf"):
+                        if not item.get("$ref"):
+                            model = item
+                        else:
+                            allof_refs.append(item.get("$ref"))
+
+                    for allof_ref in allof_refs:
+                        obj, obj_name = self.merger.follow_reference_link(allof_ref)
+                        for prop_name, prop_obj in obj.get("properties").items():
+                            model["properties"][prop_name] = prop_obj
+                            if model.get("required"):
+                                model["required"].extend(obj.get("required", []))
+                self._schemas[model_name] = model
+        return self._schemas
+
+    def _get_model_codeblocks(self, filter_tags, exclude_tags):
+        codeblocks = []
+        # first generate any additional tables from components.x-mechanic-db-tables
+        for table_name, table_def in self.oapi_obj["components"].get("x-mechanic-db-tables", {}).items():
+            if self._is_included(table_def, filter_tags, exclude_tags):
+                codeblocks.append({
+                    "type": "table",
+                    "table_name": table_name,
+                    "oapi": table_def
+                })
+
+        # next generate models from components.schemas
+        for model_name, model in self._get_schemas().items():
+            if self._is_included(model, filter_tags, exclude_tags) and model.get("x-mechanic-model", {}).get("generate"):
+                codeblocks.append({
+                    "type": "model",
+                    "class_name": model.get("x-mechanic-model", {}).get("class_name", model_name),
+                    "base_class_name": model.get("x-mechanic-model", {}).get("base_class", "db.Model"),
+                    "version": model.get("x-mechanic-version", self._get_version()),
+                    "oapi": model,
+                })
+        return codeblocks
+
+    def _get_schema_codeblocks(self, filter_tags, exclude_tags):
+        codeblocks = []
+        for model_name, model in self._get_schemas().items():
+            if self._is_included(model, filter_tags, exclude_tags):
+                codeblocks.append({
+                    "type": "schema",
+                    "class_name": model.get("x-mechanic-schema", {}).get("class_name", model_name + "Schema"),
+                    "base_class_name": model.get("x-mechanic-schema", {}).get("base_class", "ma.ModelSchema"),
+                    "version": model.get("x-mechanic-version", self._get_version()),
+                    "oapi": model,
+                })
+        return codeblocks
+
+    def _get_controller_codeblocks(self, filter_tags, exclude_tags):
+        codeblocks = []
+        for path_name, path in self.oapi_obj["paths"].items():
+            controller = path.get("x-mechanic-controller")
+            if not controller:
+                continue
+
+            model = controller.get("model")
+            schema = controller.get("schema")
+            if not controller.get("responses"):
+                controller["responses"] = dict()
+            if not controller.get("requests"):
+                controller["requests"] = dict()
+            oapi_responses = controller["responses"]
+            oapi_requests = controller["requests"]
+
+            for method_name, method in path.items():
+                if method_name in MECHANIC_SUPPORTED_HTTP_METHODS:
+                    if not oapi_responses.get(method_name):
+                        oapi_responses[method_name] = dict()
+
+                    oapi_responses[method_name]["model"] = model
+                    oapi_responses[method_name]["schema"] = schema
+
+                    for response_code, response_obj in method.get("responses", {}).items():
+                        if response_code.startswith("2"):
+                            oapi_responses[method_name]["code"] = response_code
+
+                    if method.get("requestBody"):
+                        if not oapi_requests.get(method_name):
+                            oapi_requests[method_name] = dict()
+
+                        oapi_requests[method_name]["model"] = model
+                        oapi_requests[method_name]["schema"] = schema
+
+            if self._is_included(path, filter_tags, exclude_tags):
+                codeblocks.append({
+                    "type": "controller",
+                    "class_name": controller["class_name"],
+                    "base_class_name": controller["base_class_name"],
+                    "version": path.get("x-mechanic-version", self._get_version()),
+                    "oapi": path,
+                })
+        return codeblocks
+
+    def _get_versions_codeblocks(self, filter_tags, exclude_tags):
+        controllers = []
+        for path_name, path in self.oapi_obj["paths"].items():
+            if path.get("x-mechanic-controller"):
+                controllers.append(path["x-mechanic-controller"])
+
+        return [{
+            "type": "versions",
+            "controllers": controllers
+        }]
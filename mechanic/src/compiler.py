@@ -1,22 +1,25 @@
 import os
-import json
-import pkg_resources
 import re
 import enum
 import copy
-
-# third party
-import yaml
-import yamlordereddictloader
-import inflect
-from yamlordereddictloader import OrderedDict
+import json
+import pickle
+import hashlib
+import time
+import collections
+from concurrent.futures import ProcessPoolExecutor
 
 # project
 import mechanic.src.utils as utils
 import mechanic.src.reader as reader
+from mechanic.src import pointer
 from mechanic.src.merger import Merger
+from mechanic.src.profiler import Profiler, profile_stage
 
-engine = inflect.engine()
+# inflect takes seconds to import, so the engine is only built once a model needs a table name. A parallel compile
+# computes the plurals it needs before it starts its worker processes, so that the workers do not import it again.
+_inflect_engine = None
+_plural_nouns = dict()
 
 data_map = {
     "integer": "Integer",
@@ -34,6 +37,8 @@ NATIVE_TYPES = ["integer", "number", "string", "boolean"]
 PRIMARY_KEY_LENGTH = 36
 # HTTP_METHODS = ["get", "put", "post", "delete", "options", "head", "patch", "trace"]
 MECHANIC_SUPPORTED_HTTP_METHODS = ["get", "put", "post", "delete"]
+# file the mechanic object is written to by 'mechanic build --emit-ir', incremental build state is saved next to it.
+DEFAULT_OUTPUT = "mech-compiled.yaml"
 
 
 class ControllerType(enum.Enum):
@@ -48,47 +53,241 @@ class RelationshipType(enum.IntEnum):
     o2o = 10
 
 
+def plural_noun(word):
+    """
+    Gets the plural of a noun, e.g. 'Pet' becomes 'Pets'. Results are memoized.
+    """
+    global _inflect_engine
+
+    if word not in _plural_nouns:
+        if _inflect_engine is None:
+            import inflect
+            _inflect_engine = inflect.engine()
+        _plural_nouns[word] = _inflect_engine.plural_noun(word)
+    return _plural_nouns[word]
+
+
+class OverrideIndex(object):
+    """
+    Index of an OVERRIDE_* option from the mechanic file, mapping the dotted path of a model, schema or controller (e.g.
+    models.default.Pet) to the value it is overridden with. Later entries take precedence over earlier ones.
+
+    With allow_all, each entry's 'for' is either a list of paths, or "all" with an optional 'except' list. Otherwise,
+    'for' is a single path.
+    """
+    def __init__(self, option_key, entries, allow_all=True):
+        self.option_key = option_key
+        self.errors = []
+        # path -> (position of the entry, value)
+        self._paths = dict()
+        # (position of the entry, value, except) of the "all" entries, last one first
+        self._all = []
+
+        if not isinstance(entries, list):
+            self.errors.append("'%s' must be a list." % option_key)
+            return
+
+        for position, entry in enumerate(entries):
+            if not entry and allow_all:
+                continue
+
+            entry_for = entry.get("for") if isinstance(entry, dict) else None
+            if not entry_for:
+                self.errors.append("The 'for' attribute is required in the '%s' option (entry %d)."
+                                   % (option_key, position))
+            elif allow_all and isinstance(entry_for, list):
+                for path in entry_for:
+                    self._paths[path] = (position, entry.get("with"))
+            elif allow_all and isinstance(entry_for, str) and entry_for.lower().strip() == "all":
+                self._all.insert(0, (position, entry.get("with"), entry.get("except", [])))
+            elif not allow_all and isinstance(entry_for, str):
+                self._paths[entry_for] = (position, entry.get("with"))
+            else:
+                self.errors.append("'%s' is not formatted properly (entry %d)." % (option_key, position))
+
+    def get(self, path, default=None):
+        position, value = self._paths.get(path, (-1, default))
+
+        for all_position, all_value, all_except in self._all:
+            if path not in all_except:
+                if all_position > position:
+                    value = all_value
+                break
+        return value
+
+
+class RelationshipGraph(object):
+    """
+    Graph of the foreign keys between models. Models are the nodes, and each foreign key is an edge keyed by
+    (model_a, model_b), where model_a is the model that has the relationship to model_b.
+
+    resolve() keeps one foreign key for each pair of related models: the one with the higher relationship type, the
+    second one if both are one to one, and the first one if both are one to many, which makes it many to many. Pairs in
+    OVERRIDE_MANY_TO_MANY lose both foreign keys and become many to many instead.
+    """
+    def __init__(self, foreign_keys, many_to_many_overrides):
+        self.edges = collections.OrderedDict()
+        # model name to the edges from or to that model
+        self.adjacency = collections.defaultdict(collections.OrderedDict)
+        for key, fkey in foreign_keys.items():
+            model_a, model_b = key.split(".")
+            self.edges[(model_a, model_b)] = fkey
+            self.adjacency[model_a][(model_a, model_b)] = fkey
+            self.adjacency[model_b][(model_a, model_b)] = fkey
+
+        self.overrides = set(frozenset([item["model1"], item["model2"]]) for item in many_to_many_overrides)
+        # (model1, model2) pairs that need an association table, in the order they were found
+        self.many_to_many = []
+
+    def resolve(self):
+        resolved = set()
+
+        for edge, fkey in list(self.edges.items()):
+            pair = frozenset(edge)
+            if pair in resolved:
+                continue
+            resolved.add(pair)
+
+            model_a, model_b = edge
+            reverse = (model_b, model_a)
+            reverse_fkey = self.edges.get(reverse) if reverse != edge else None
+
+            if pair in self.overrides:
+                # the association table takes the orientation of the last foreign key between the two models.
+                self.many_to_many.append(reverse if reverse_fkey else edge)
+                self._remove_edge(edge)
+                if reverse_fkey:
+                    self._remove_edge(reverse)
+            elif reverse_fkey:
+                rel_type = RelationshipType[fkey["rel"]]
+                reverse_rel_type = RelationshipType[reverse_fkey["rel"]]
+
+                if rel_type == RelationshipType.o2m and reverse_rel_type == RelationshipType.o2m:
+                    fkey["rel"] = RelationshipType.m2m.name
+                    self.many_to_many.append(edge)
+                    self._remove_edge(reverse)
+                elif rel_type > reverse_rel_type:
+                    self._remove_edge(reverse)
+                else:
+                    self._remove_edge(edge)
+
+    def get_edges(self, model_name):
+        """
+        :return: the foreign keys from or to a model, keyed by (model_a, model_b)
+        """
+        return collections.OrderedDict(self.adjacency.get(model_name, {}))
+
+    def _remove_edge(self, edge):
+        self.edges.pop(edge)
+        for model_name in set(edge):
+            self.adjacency[model_name].pop(edge)
+
+
+# Intermediate representation of a schema in components/schemas, with the names that every build pass needs.
+SchemaRecord = collections.namedtuple("SchemaRecord",
+                                      ["schema_name", "schema_obj", "namespace", "model_name", "mschema_name"])
+
+
+# Compiler that the worker processes of a parallel build build fragments with.
+_worker_compiler = None
+
+
+def _init_worker(compiler, plural_nouns):
+    global _worker_compiler
+    _worker_compiler = compiler
+    _plural_nouns.update(plural_nouns)
+
+
+def _build_fragments_in_worker(records):
+    if _worker_compiler.profiler is not None:
+        _worker_compiler.profiler = Profiler(top_schemas=_worker_compiler.profiler.top_schemas)
+    return _worker_compiler._build_fragments(records), _worker_compiler.profiler
+
+
 class Compiler(object):
-    def __init__(self, options, mechanic_file_path="", output="mech-compiled.yaml"):
+    """
+    Compiles an OpenAPI 3.0 spec and the mechanic file options into the mechanic object, which the Generator turns into
+    code. The mechanic object is kept in self.mech_obj, and is also written to output unless output is None. The spec is
+    read from the file named by the OPENAPI option, or can be passed in as oapi_obj, in which case it is merged in place.
+
+    With incremental set, the result of the per-schema build passes is saved next to the output file, along with a
+    manifest of the hash of every schema and of the schemas it references. On the next run, only schemas that changed,
+    or that reference a schema that changed, go through those passes again; the passes that relate schemas to each
+    other (foreign keys, many to many relationships, nested schemas and controllers) always run on the whole spec.
+
+    incremental_state is a dictionary to keep the saved state of incremental compiles in memory instead of in files,
+    e.g. between the builds of 'mechanic watch'. Pass the same dictionary to each compiler.
+
+    With jobs > 1, the per-schema build passes run in a pool of that many worker processes, each building a contiguous
+    slice of the schemas. The results are linked in the order of the spec, so the output is the same as a serial build.
+
+    With a profiler, the time of each build pass and of each schema is recorded in it. The build runs the same way as
+    without one; the time of a schema is the time the per-schema loops of the build passes spent on it.
+    """
+    MANIFEST_VERSION = 1
+
+    def __init__(self, options, mechanic_file_path="", output=None, document_cache=None, compact=False,
+                 incremental=False, jobs=1, oapi_obj=None, profiler=None, incremental_state=None):
         self.options = options
-        self.oapi_file = os.path.abspath(
-            os.path.realpath(os.path.join(os.path.dirname(mechanic_file_path), options[reader.OPENAPI3_FILE_KEY])))
-        self.merger = Merger(self.oapi_file, os.path.dirname(mechanic_file_path) + "/temp.yaml")
-        self.merger.merge()
+        self.profiler = profiler
+        # malformed options are reported before the spec is merged, which can take long for large specs
+        self._index_overrides()
+        self.oapi_file = None
+        if options[reader.OPENAPI3_FILE_KEY]:
+            self.oapi_file = os.path.abspath(
+                os.path.realpath(os.path.join(os.path.dirname(mechanic_file_path), options[reader.OPENAPI3_FILE_KEY])))
+        self.merger = Merger(self.oapi_file,
+                             None,
+                             document_cache=document_cache,
+                             jobs=jobs,
+                             oapi_obj=oapi_obj)
+        with profile_stage(self.profiler, "merge"):
+            self.merger.merge()
         self.oapi_obj = self.merger.oapi_obj
-        self.models = dict()
-        self.schemas = dict()
-        self.controllers = dict()
-        self.resources = dict()
-        self.namespaces = dict()
-        self.foreign_keys = dict()
-        self.many_to_many = dict()
+        self.pointer_index = self.merger.pointer_index
+        self._reset()
         self.version = self.oapi_obj.get("info", {}).get("version", "0.0.1").replace(".", "").replace("-", "").replace("_", "")
         self.title = self.oapi_obj.get("info", {}).get("title", "Mechanic Generated API")
         self.output = output
+        self.compact = compact
+        self.incremental = incremental
+        self.incremental_state = incremental_state
+        self.jobs = jobs
+        self.manifest_file = (self.output or DEFAULT_OUTPUT) + ".manifest.json"
+        self.fragments_file = (self.output or DEFAULT_OUTPUT) + ".fragments.pickle"
+        self.mech_obj = None
+        self.schema_records = []
+        # names of the schemas that went through the per-schema build passes in the last incremental compile
+        self.stale_schemas = []
+        self._foreign_key_log = None
+        self._override_module_paths = dict()
 
     def compile(self):
-        self.build_models_pass1()
-        self.build_models_pass2()
-        self.build_models_pass3()
-        self.build_models_pass4()
-        self.build_models_pass5()
-        self.build_models_pass6()
-
-        self.build_mschemas_pass1()
-        self.build_mschemas_pass2()
-        self.build_mschemas_pass3()
-        self.build_mschemas_pass4()
-        self.build_controllers_pass1()
+        with profile_stage(self.profiler, "normalize"):
+            self.normalize()
 
-        self.write_to_file()
+        if (self.incremental or self.jobs > 1) and not self._has_name_collisions():
+            self._compile_fragments()
+        else:
+            self._run_pass(self.build_models_pass1)
+            self._run_pass(self.build_models_pass2)
+            self._run_pass(self.build_models_pass3)
+            self._run_pass(self.build_models_pass4)
+            self._run_pass(self.build_models_pass5)
+            self._run_pass(self.build_models_pass6)
+
+            self._run_pass(self.build_mschemas_pass1)
+            self._run_pass(self.build_mschemas_pass2)
+            self._run_pass(self.build_mschemas_pass3)
+            self._run_pass(self.build_mschemas_pass4)
+            self._run_pass(self.build_controllers_pass1)
 
-    def write_to_file(self):
         self.mech_obj = {
             "openapi_file_location": self.oapi_file,
             "version": self.version,
             "title": self.title,
             "resources": self.resources,
+            "model_resources": self.model_resources,
             "models": self.models,
             "schemas": self.schemas,
             "foreign_keys": self.foreign_keys,
@@ -97,28 +296,304 @@ class Compiler(object):
             "namespaces": self.namespaces
         }
 
-        with open(self.output, "w") as f:
-            if self.output.endswith(".json"):
-                json_data = json.dumps(self.mech_obj, indent=3)
-                f.write(json_data)
-            elif self.output.endswith(".yaml") or self.output.endswith(".yml"):
-                yaml_data = yaml.dump(OrderedDict(self.mech_obj),
-                                      Dumper=yamlordereddictloader.Dumper,
-                                      default_flow_style=False)
-                f.write(yaml_data)
-            else:
-                raise SyntaxError("Specified output file is not of correct format. Must be either json or yaml.")
+        if self.output:
+            with profile_stage(self.profiler, "write_ir"):
+                self.write_to_file()
+
+        if self.profiler is not None:
+            self._count_compiled_objects()
+        return self.mech_obj
+
+    def _run_pass(self, build_pass):
+        with profile_stage(self.profiler, "compile." + build_pass.__name__):
+            build_pass()
+
+    def _iter_schema_records(self):
+        """
+        Iterates over the schema records in a build pass. With a profiler, the time the pass spends on each schema is
+        added to the compile time of that schema.
+        """
+        if self.profiler is None:
+            for record in self.schema_records:
+                yield record
+            return
+
+        for record in self.schema_records:
+            start = time.perf_counter()
+            yield record
+            self.profiler.add_schema_time(record.schema_name, time.perf_counter() - start)
+
+    def _count_compiled_objects(self):
+        self.profiler.count("schemas", len(self.schema_records))
+        self.profiler.count("paths", len(self.oapi_obj.get("paths", {})))
+        self.profiler.count("refs", sum(1 for pointer in self.pointer_index if pointer.endswith("/$ref")))
+        self.profiler.count("models", len(self.models))
+        self.profiler.count("relationships", sum(len(model["relationships"]) for model in self.models.values()))
+        self.profiler.count("foreign_keys", len(self.foreign_keys))
+        self.profiler.count("many_to_many", len(self.many_to_many))
+        self.profiler.count("marshmallow_schemas", len(self.schemas))
+        self.profiler.count("controllers", len(self.controllers))
+        if self.incremental:
+            self.profiler.count("stale_schemas", len(self.stale_schemas))
+
+    def _compile_fragments(self):
+        records = self.schema_records
+        stale = records
+        fragments = dict()
+
+        if self.incremental:
+            with profile_stage(self.profiler, "compile.read_fragments"):
+                build_key = self._get_build_key()
+                manifest = self._read_manifest(build_key)
+                if manifest:
+                    fragments = self._read_fragments()
+
+                hashes = dict()
+                dependencies = dict()
+                for record in records:
+                    hashes[record.schema_name], dependencies[record.schema_name] = self._hash_schema(record.schema_obj)
+
+                stale = []
+                for record in records:
+                    entry = manifest.get(record.schema_name)
+                    if not entry or record.schema_name not in fragments or \
+                            entry["hash"] != hashes[record.schema_name] or \
+                            any(hashes.get(dep) != digest for dep, digest in entry["dependencies"].items()):
+                        stale.append(record)
+
+        self.stale_schemas = [record.schema_name for record in stale]
+
+        if self.jobs > 1 and len(stale) > 1:
+            size = -(-len(stale) // self.jobs)
+            # default table names are the plurals of the model names, see _init_model.
+            plural_nouns = dict((word, plural_noun(word)) for word in
+                                (self._get_tablename_noun(record.model_name) for record in stale))
+            with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker,
+                                     initargs=(self._get_worker_compiler(), plural_nouns)) as executor:
+                for result, worker_profiler in executor.map(_build_fragments_in_worker,
+                                                            [stale[i:i + size] for i in range(0, len(stale), size)]):
+                    fragments.update(result)
+                    if worker_profiler is not None:
+                        self.profiler.merge(worker_profiler)
+        else:
+            fragments.update(self._build_fragments(stale))
+        fragments = dict((record.schema_name, fragments[record.schema_name]) for record in records)
+
+        if self.incremental:
+            # fragments are saved now, because linking them modifies the models in place.
+            with profile_stage(self.profiler, "compile.write_fragments"):
+                self._write_manifest(build_key, fragments, hashes, dependencies)
+
+        self.schema_records = records
+        self._link_fragments(fragments)
+
+    def _build_fragments(self, records):
+        """
+        Runs the per-schema build passes for the given schemas on their own.
+        :param records: SchemaRecords to build
+        :return: dictionary of schema name to fragment, which has the model and marshmallow schema built for the schema
+        (None if excluded), and the foreign keys added by model passes 2, 3 and 4, in the order they were added.
+        """
+        self._reset()
+        self.schema_records = records
+        foreign_key_logs = []
+
+        self._run_pass(self.build_models_pass1)
+        for build_pass in [self.build_models_pass2, self.build_models_pass3, self.build_models_pass4]:
+            self._foreign_key_log = []
+            self._run_pass(build_pass)
+            foreign_key_logs.append(self._foreign_key_log)
+        self._foreign_key_log = None
+
+        self._run_pass(self.build_mschemas_pass1)
+        self._run_pass(self.build_mschemas_pass3)
+        self._run_pass(self.build_mschemas_pass4)
+
+        # foreign keys are named after the model they are added from, e.g. 'Pet.Owner'
+        model_foreign_keys = dict((record.model_name, [[], [], []]) for record in records)
+        for i, log in enumerate(foreign_key_logs):
+            for key, fkey in log:
+                model_foreign_keys[key.split(".")[0]][i].append((key, fkey))
+
+        fragments = dict()
+        for record in records:
+            resource = self.resources[record.schema_name]
+            fragments[record.schema_name] = {
+                "model": self.models[record.model_name] if resource.get("model") else None,
+                "mschema": self.schemas[record.mschema_name] if resource.get("schema") else None,
+                "foreign_keys": model_foreign_keys[record.model_name]
+            }
+        return fragments
+
+    def _link_fragments(self, fragments):
+        """
+        Adds the fragment of each schema to the mechanic object in the same order as the build passes would have, then
+        runs the build passes that relate schemas to each other.
+        """
+        self._reset()
+
+        for record in self.schema_records:
+            self._init_namespace(record.namespace)
+            self._put_resource_to_mechanic(fragments[record.schema_name]["model"], record.model_name,
+                                           record.schema_name, "model")
+
+        for i in range(3):
+            for record in self.schema_records:
+                for key, fkey in fragments[record.schema_name]["foreign_keys"][i]:
+                    self.foreign_keys[key] = fkey
+
+        self._run_pass(self.build_models_pass5)
+        self._run_pass(self.build_models_pass6)
+
+        for record in self.schema_records:
+            self._put_resource_to_mechanic(fragments[record.schema_name]["mschema"], record.mschema_name,
+                                           record.schema_name, "schema")
+
+        self._run_pass(self.build_mschemas_pass2)
+        self._run_pass(self.build_controllers_pass1)
+
+    def _reset(self):
+        self.models = dict()
+        self.schemas = dict()
+        self.controllers = dict()
+        self.resources = dict()
+        # model name -> name of the first resource that registered it
+        self.model_resources = dict()
+        self.namespaces = dict()
+        self.foreign_keys = dict()
+        self.many_to_many = dict()
+        self.relationship_graph = None
+
+    def _get_worker_compiler(self):
+        """
+        Gets a copy of this compiler for the worker processes of a parallel compile, with only what the per-schema build
+        passes need: the options, the override indexes, the spec version and the pointer index, which references between
+        schemas are resolved with. The merger, its document cache, the incremental state and the build results are left
+        out, so that they are not sent to every worker. The schema records are sent with each slice of work instead.
+        """
+        worker = copy.copy(self)
+        worker.merger = None
+        worker.oapi_obj = None
+        worker.incremental_state = None
+        worker.mech_obj = None
+        worker.schema_records = []
+        worker.stale_schemas = []
+        worker._reset()
+        return worker
+
+    def _has_name_collisions(self):
+        """
+        Schemas that share a model or marshmallow schema name are built into the same object, so they can not be built
+        separately.
+        """
+        model_names = set(record.model_name for record in self.schema_records)
+        mschema_names = set(record.mschema_name for record in self.schema_records)
+        return len(model_names) != len(self.schema_records) or len(mschema_names) != len(self.schema_records)
+
+    def _get_build_key(self):
+        """
+        Gets a hash of everything besides the schemas themselves that the per-schema build passes depend on.
+        """
+        key = json.dumps([self.MANIFEST_VERSION, self.version, self.options], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _hash_schema(self, schema_obj):
+        """
+        :param schema_obj: schema from components/schemas
+        :return: hash of the schema, and the names of the schemas it references
+        """
+        serialized = json.dumps(schema_obj, default=str)
+        # a reference can point into another schema, e.g. '#/components/schemas/Base/properties/inner', which depends
+        # on the schema 'Base'.
+        dependencies = [pointer.unescape(name)
+                        for name in re.findall(r'"\$ref": "#/components/schemas/([^"/]+)', serialized)]
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest(), dependencies
+
+    def _read_manifest(self, build_key):
+        if self.incremental_state is not None:
+            manifest = self.incremental_state.get("manifest", dict())
+            return manifest.get("schemas", dict()) if manifest.get("build_key") == build_key else dict()
+
+        try:
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+        if manifest.get("version") != self.MANIFEST_VERSION or manifest.get("build_key") != build_key:
+            return dict()
+        return manifest.get("schemas", dict())
+
+    def _read_fragments(self):
+        if self.incremental_state is not None:
+            return pickle.loads(self.incremental_state["fragments"])
+
+        try:
+            with open(self.fragments_file, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return dict()
+
+    def _write_manifest(self, build_key, fragments, hashes, dependencies):
+        manifest_schemas = dict()
+        for schema_name, digest in hashes.items():
+            manifest_schemas[schema_name] = {
+                "hash": digest,
+                "dependencies": dict((dep, hashes.get(dep)) for dep in dependencies[schema_name])
+            }
+        manifest = {"version": self.MANIFEST_VERSION, "build_key": build_key, "schemas": manifest_schemas}
+
+        if self.incremental_state is not None:
+            # the fragments are kept pickled, because linking them modifies them in place.
+            self.incremental_state["fragments"] = pickle.dumps(fragments, protocol=pickle.HIGHEST_PROTOCOL)
+            self.incremental_state["manifest"] = manifest
+            return
+
+        with open(self.fragments_file, "wb") as f:
+            pickle.dump(fragments, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # one entry per schema, so the manifest is written without indentation to keep it fast to write and read.
+        with open(self.manifest_file, "w") as f:
+            f.write(json.dumps(manifest))
+
+    def normalize(self):
+        """
+        Walks components/schemas once and builds a SchemaRecord for each schema, so the build passes do not need to
+        recompute the namespace, model name and schema name from the naming patterns. Also validates the schema types.
+        """
+        self.schema_records = []
+        default_namespace = self.options[reader.DEFAULT_NAMESPACE_KEY]
+
+        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
+            if schema_obj.get("type") in NATIVE_TYPES:
+                raise SyntaxError("mechanic currently does not support schemas that are not of type 'object' or 'type' "
+                                  "array. Schemas of type 'array' must have the 'items' attribute contain a '$ref' to "
+                                  "another schema. Consider changing the schema type to an 'object' and adding "
+                                  "properties. Object in error: %s" % (schema_name))
+            elif schema_obj.get("type") == "array" and not schema_obj.get("items", {}).get("$ref"):
+                raise SyntaxError("mechanic currently does not support schemas that are not of type 'object' or 'type' "
+                                  "array. Schemas of type 'array' must have the 'items' attribute contain a '$ref' to "
+                                  "another schema. Consider changing the schema type to an 'object' and adding "
+                                  "properties. Object in error: %s" % (schema_name))
+
+            namespace = schema_obj.get(NAMESPACE_EXT, default_namespace)
+            self.schema_records.append(SchemaRecord(
+                schema_name=schema_name,
+                schema_obj=schema_obj,
+                namespace=namespace,
+                model_name=self._get_model_name_from_pattern(schema_name, namespace=namespace, version=self.version),
+                mschema_name=self._get_mschema_name_from_pattern(schema_name, namespace=namespace, version=self.version)
+            ))
+
+    def write_to_file(self):
+        utils.serialize_to_file(self.mech_obj, self.output, compact=self.compact)
 
     def build_models_pass1(self):
         """
         Pass 1 only handles properties, no relationships
         :return:
         """
-        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
-            namespace = schema_obj.get(NAMESPACE_EXT, self.options[reader.DEFAULT_NAMESPACE_KEY])
-            model_name = self._get_model_name_from_pattern(schema_name,
-                                                           namespace=namespace,
-                                                           version=self.version)
+        for schema_name, schema_obj, namespace, model_name, mschema_name in self._iter_schema_records():
             model = self._init_model(model_name)
             model["namespace"] = namespace
 
@@ -143,17 +618,6 @@ class Compiler(object):
             self._init_namespace(model["namespace"])
 
             # Handle properties
-            if schema_obj.get("type") in NATIVE_TYPES:
-                raise SyntaxError("mechanic currently does not support schemas that are not of type 'object' or 'type' "
-                                  "array. Schemas of type 'array' must have the 'items' attribute contain a '$ref' to "
-                                  "another schema. Consider changing the schema type to an 'object' and adding "
-                                  "properties. Object in error: %s" % (schema_name))
-            elif schema_obj.get("type") == "array" and not schema_obj.get("items", {}).get("$ref"):
-                raise SyntaxError("mechanic currently does not support schemas that are not of type 'object' or 'type' "
-                                  "array. Schemas of type 'array' must have the 'items' attribute contain a '$ref' to "
-                                  "another schema. Consider changing the schema type to an 'object' and adding "
-                                  "properties. Object in error: %s" % (schema_name))
-
             for prop_name, prop_obj in schema_obj.get("properties", {}).items():
                 if prop_obj.get("type") in NATIVE_TYPES:
                     self._add_column(prop_name, model, prop_obj, prop_name, schema_obj)
@@ -164,11 +628,7 @@ class Compiler(object):
         """
         Pass 2 handles allOf composition
         """
-        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
-            namespace = schema_obj.get(NAMESPACE_EXT, self.options[reader.DEFAULT_NAMESPACE_KEY])
-            model_name = self._get_model_name_from_pattern(schema_name,
-                                                           namespace=namespace,
-                                                           version=self.version)
+        for schema_name, schema_obj, namespace, model_name, mschema_name in self._iter_schema_records():
             existing_model = self.models.get(model_name)
             if not existing_model:
                 # model has been excluded
@@ -196,11 +656,7 @@ class Compiler(object):
         """
         Pass 3 handles oneOf and oneOf relationships.
         """
-        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
-            namespace = schema_obj.get(NAMESPACE_EXT, self.options[reader.DEFAULT_NAMESPACE_KEY])
-            model_name = self._get_model_name_from_pattern(schema_name,
-                                                           namespace=namespace,
-                                                           version=self.version)
+        for schema_name, schema_obj, namespace, model_name, mschema_name in self._iter_schema_records():
             existing_model = self.models.get(model_name)
             if not existing_model:
                 # model has been excluded
@@ -249,11 +705,7 @@ class Compiler(object):
         """
         Pass 4 handles relationships NOT in oneOf's
         """
-        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
-            namespace = schema_obj.get(NAMESPACE_EXT, self.options[reader.DEFAULT_NAMESPACE_KEY])
-            model_name = self._get_model_name_from_pattern(schema_name,
-                                                           namespace=namespace,
-                                                           version=self.version)
+        for schema_name, schema_obj, namespace, model_name, mschema_name in self._iter_schema_records():
             existing_model = self.models.get(model_name)
             if not existing_model:
                 # model has been excluded
@@ -316,53 +768,13 @@ class Compiler(object):
         """
         Pass 5 finding the correct foreign keys
         """
-        fkey_copy = copy.deepcopy(self.foreign_keys)
-        for fkey_models, fkey in fkey_copy.items():
-            model_a = fkey_models.split(".")[0]
-            model_b = fkey_models.split(".")[1]
-            rel_type = RelationshipType[fkey["rel"]]
-
-            # see if there is a foreign key for the reverse relationship
-            reversed_models = model_b + "." + model_a
-
-            # see if the relationship is overridden in config file
-            overridden_rel_types = self.options[reader.OVERRIDE_MANY_TO_MANY_KEY]
-            for item in overridden_rel_types:
-                if (item["model1"] == model_a and item["model2"] == model_b) or \
-                        (item["model1"] == model_b and item["model2"] == model_a):
-                    self._add_many_to_many(model_a, model_b)
-                    self.foreign_keys.pop(fkey_models, None)
-                    self.foreign_keys.pop(reversed_models, None)
-
-            reverse_fkey = self.foreign_keys.get(reversed_models)
-
-            # If the reversed_models == fkey_models, that means it is a self referential foreign key, in which case no
-            # need to remove any key.
-            if reverse_fkey and reversed_models != fkey_models:
-                reverse_rel_type = RelationshipType[reverse_fkey["rel"]]
+        self.relationship_graph = RelationshipGraph(self.foreign_keys, self.options[reader.OVERRIDE_MANY_TO_MANY_KEY])
+        self.relationship_graph.resolve()
 
-                if rel_type == RelationshipType.o2m and reverse_rel_type == RelationshipType.o2m:
-                    rel_type = RelationshipType.m2m
-                    reverse_rel_type = RelationshipType.m2m
-                    self.foreign_keys[reversed_models]["rel"] = reverse_rel_type.name
-                    self.foreign_keys[fkey_models]["rel"] = rel_type.name
-
-                    # add m2m
-                    self._add_many_to_many(model_a, model_b)
-
-                # We only want one foreign key between the 2 models, so remove one based on the rel_type
-                if rel_type > reverse_rel_type:
-                    if self.foreign_keys.get(reversed_models):
-                        self.foreign_keys.pop(reversed_models)
-                elif rel_type < reverse_rel_type:
-                    if self.foreign_keys.get(fkey_models):
-                        self.foreign_keys.pop(fkey_models)
-                else:
-                    if rel_type == RelationshipType.m2m and reverse_rel_type == RelationshipType.m2m:
-                        self._add_many_to_many(model_a, model_b)
-                    else:
-                        # remove one of them cause they each have the same rel
-                        self.foreign_keys.pop(fkey_models)
+        self.foreign_keys = dict((model_a + "." + model_b, fkey)
+                                 for (model_a, model_b), fkey in self.relationship_graph.edges.items())
+        for model_a, model_b in self.relationship_graph.many_to_many:
+            self._add_many_to_many(model_a, model_b)
 
     def build_models_pass6(self):
         """
@@ -390,11 +802,7 @@ class Compiler(object):
         Pass 1 handles schemas that are associated with models.
         """
         # If model already built, use that
-        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
-            namespace = schema_obj.get(NAMESPACE_EXT, self.options[reader.DEFAULT_NAMESPACE_KEY])
-            mschema_name = self._get_mschema_name_from_pattern(schema_name,
-                                                               namespace=namespace,
-                                                               version=self.version)
+        for schema_name, schema_obj, namespace, model_name, mschema_name in self._iter_schema_records():
             resource_model_name = self.resources.get(schema_name, {}).get("model")
             existing_model_obj = self.models.get(resource_model_name)
             mschema = self._init_mschema(mschema_name)
@@ -426,11 +834,7 @@ class Compiler(object):
         """
         Pass 2 handles creating MechanicEmbeddable/Nested Marshmallow fields"
         """
-        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
-            namespace = schema_obj.get(NAMESPACE_EXT, self.options[reader.DEFAULT_NAMESPACE_KEY])
-            mschema_name = self._get_mschema_name_from_pattern(schema_name,
-                                                               namespace=namespace,
-                                                               version=self.version)
+        for schema_name, schema_obj, namespace, model_name, mschema_name in self._iter_schema_records():
 
             existing_mschema = self.schemas.get(mschema_name)
             if not existing_mschema:
@@ -457,11 +861,7 @@ class Compiler(object):
         """
         Pass 3 handles creating Marshmallow schemas for objects that do not have a model already created for them.
         """
-        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
-            namespace = schema_obj.get(NAMESPACE_EXT, self.options[reader.DEFAULT_NAMESPACE_KEY])
-            mschema_name = self._get_mschema_name_from_pattern(schema_name,
-                                                               namespace=namespace,
-                                                               version=self.version)
+        for schema_name, schema_obj, namespace, model_name, mschema_name in self._iter_schema_records():
 
             existing_mschema = self.schemas.get(mschema_name)
             if not existing_mschema:
@@ -472,18 +872,7 @@ class Compiler(object):
             existing_model_obj = self.models.get(resource_model_name)
 
             if not (resource_model_name and existing_model_obj):
-                # Handle properties
-                if schema_obj.get("type") in NATIVE_TYPES:
-                    raise SyntaxError("mechanic currently does not support schemas that are not of type 'object' or 'type' "
-                                      "array. Schemas of type 'array' must have the 'items' attribute contain a '$ref' to "
-                                      "another schema. Consider changing the schema type to an 'object' and adding "
-                                      "properties. Object in error: %s" % (schema_name))
-                elif schema_obj.get("type") == "array" and not schema_obj.get("items", {}).get("$ref"):
-                    raise SyntaxError("mechanic currently does not support schemas that are not of type 'object' or 'type' "
-                                      "array. Schemas of type 'array' must have the 'items' attribute contain a '$ref' to "
-                                      "another schema. Consider changing the schema type to an 'object' and adding "
-                                      "properties. Object in error: %s" % (schema_name))
-
+                # Handle properties (the schema type was already validated by normalize)
                 for prop_name, prop_obj in schema_obj.get("properties", {}).items():
                     if prop_obj.get("type") in NATIVE_TYPES:
                         self._add_field(prop_name, existing_mschema, prop_obj, prop_name, schema_obj)
@@ -492,11 +881,7 @@ class Compiler(object):
         """
         Pass 4 handles additional fields that need to be added for things such as "enum" and "pattern" validation.
         """
-        for schema_name, schema_obj in self.oapi_obj["components"]["schemas"].items():
-            namespace = schema_obj.get(NAMESPACE_EXT, self.options[reader.DEFAULT_NAMESPACE_KEY])
-            mschema_name = self._get_mschema_name_from_pattern(schema_name,
-                                                               namespace=namespace,
-                                                               version=self.version)
+        for schema_name, schema_obj, namespace, model_name, mschema_name in self._iter_schema_records():
 
             existing_mschema = self.schemas.get(mschema_name)
             if not existing_mschema:
@@ -572,7 +957,7 @@ class Compiler(object):
                             # assign this controller to the model
                             if response.get("model"):
                                 self.models[response["model"]]["controller"] = controller_name.lower()
-                                self.models[response["model"]]["namespace"] = controller["namespace"]
+                                self._set_model_namespace(response["model"], controller["namespace"])
 
                     requestbody_obj = method_obj.get("requestBody", {})
                     request = self._init_controller_request()
@@ -590,7 +975,7 @@ class Compiler(object):
 
                     if request.get("model"):
                         self.models[request["model"]]["controller"] = controller_name.lower()
-                        self.models[request["model"]]["namespace"] = controller["namespace"]
+                        self._set_model_namespace(request["model"], controller["namespace"])
 
             path = self._get_controller_path_from_options(namespace=controller["namespace"],
                                                           version=self.version)
@@ -681,9 +1066,9 @@ class Compiler(object):
         return ctype
 
     def _find_schema_from_model_name(self, model_name):
-        for res, res_obj in self.resources.items():
-            if res_obj.get("model") == model_name:
-                return res_obj.get("schema")
+        resource = self.model_resources.get(model_name)
+        if resource:
+            return self.resources[resource].get("schema")
 
     def _init_mschema(self, schema_name):
         return {
@@ -734,6 +1119,7 @@ class Compiler(object):
         if type == "model" and not self._is_model_excluded(oapi_schema_name):
             self.models[obj_name] = obj
             self.resources[oapi_schema_name][type] = obj_name
+            self.model_resources.setdefault(obj_name, oapi_schema_name)
             self._init_namespace(obj["namespace"])
             self.namespaces[obj["namespace"]]["models"].append(obj_name)
         elif type == "schema" and not self._is_schema_excluded(oapi_schema_name):
@@ -747,6 +1133,18 @@ class Compiler(object):
         self._init_namespace(controller["namespace"])
         self.namespaces[controller["namespace"]]["controllers"].append(controller_name)
 
+    def _set_model_namespace(self, model_name, namespace):
+        """
+        Moves a model to another namespace, keeping the namespaces index up to date.
+        """
+        model = self.models[model_name]
+        if model["namespace"] != namespace:
+            if model_name in self.namespaces.get(model["namespace"], {}).get("models", []):
+                self.namespaces[model["namespace"]]["models"].remove(model_name)
+            self._init_namespace(namespace)
+            self.namespaces[namespace]["models"].append(model_name)
+            model["namespace"] = namespace
+
     def _is_model_excluded(self, oapi_schema_name):
         excluded_models = self.options[reader.EXCLUDE_MODEL_GENERATION_KEY]
         return oapi_schema_name in excluded_models or (excluded_models == "all")
@@ -856,6 +1254,9 @@ class Compiler(object):
             "secondary_name": None
         }
 
+        if self._foreign_key_log is not None:
+            self._foreign_key_log.append((keys, self.foreign_keys[keys]))
+
         # print(self.foreign_keys[keys])
 
         # relationship["foreign_keys"].append(foreign_key_name)
@@ -899,109 +1300,28 @@ class Compiler(object):
         return controller_name
 
     def _get_db_schema_name_from_options(self, model_name, default_schemaname, namespace=None, version=None):
-        models_path_key = utils.replace_template_var(self.options[reader.MODELS_PATH_KEY],
-                                                     namespace=namespace,
-                                                     version=version)
-        model_path = models_path_key.replace("/", ".").replace(".py", "") + "." + model_name
-        overridden_schemanames = self.options[reader.OVERRIDE_DB_SCHEMA_NAMES_KEY]
-        schemaname = default_schemaname
-
-        if not isinstance(overridden_schemanames, list):
-            raise SyntaxError("'" + reader.OVERRIDE_DB_SCHEMA_NAMES_KEY + "' must be a list." )
-
-        for item in overridden_schemanames:
-            table_for = item.get("for")
-            if table_for:
-                if model_path == table_for:
-                    schemaname = item.get("with")
-            else:
-                raise SyntaxError("The 'for' attribute is required in the '" +
-                                  reader.OVERRIDE_DB_SCHEMA_NAMES_KEY +
-                                  "' option.")
-        return schemaname
+        model_path = self._get_override_path(reader.MODELS_PATH_KEY, model_name, namespace=namespace, version=version)
+        return self.override_indexes[reader.OVERRIDE_DB_SCHEMA_NAMES_KEY].get(model_path, default_schemaname)
 
     def _get_tablename_from_options(self, model_name, default_tablename, namespace=None, version=None):
-        models_path_key = utils.replace_template_var(self.options[reader.MODELS_PATH_KEY],
-                                                     namespace=namespace,
-                                                     version=version)
-        model_path = models_path_key.replace("/", ".").replace(".py", "") + "." + model_name
-        overridden_tables = self.options[reader.OVERRIDE_TABLE_NAMES_KEY]
-        tablename = default_tablename
-
-        if not isinstance(overridden_tables, list):
-            raise SyntaxError("'" + reader.OVERRIDE_TABLE_NAMES_KEY + "' must be a list." )
-
-        for item in overridden_tables:
-            table_for = item.get("for")
-            if table_for:
-                if model_path == table_for:
-                    tablename = item.get("with")
-            else:
-                raise SyntaxError("The 'for' attribute is required in the '" +
-                                  reader.OVERRIDE_TABLE_NAMES_KEY +
-                                  "' option.")
-        return tablename
+        model_path = self._get_override_path(reader.MODELS_PATH_KEY, model_name, namespace=namespace, version=version)
+        return self.override_indexes[reader.OVERRIDE_TABLE_NAMES_KEY].get(model_path, default_tablename)
 
     def _get_base_model_from_options(self, model_name, namespace=None, version=None):
-        models_path_key = utils.replace_template_var(self.options[reader.MODELS_PATH_KEY],
-                                                     namespace=namespace,
-                                                     version=version)
-        model_path = models_path_key.replace("/", ".").replace(".py", "") + "." + model_name
+        model_path = self._get_override_path(reader.MODELS_PATH_KEY, model_name, namespace=namespace, version=version)
         base_model = self.options[reader.DEFAULT_BASE_MODEL_KEY]
-        overridden_base_models = self.options[reader.OVERRIDE_BASE_MODEL_KEY]
-
-        if not isinstance(overridden_base_models, list):
-            raise SyntaxError("'" + reader.OVERRIDE_BASE_MODEL_KEY + "' must be a list." )
-
-        for bm in overridden_base_models:
-            if bm:
-                bm_for = bm.get("for")
-                if bm_for:
-                    if isinstance(bm_for, str):
-                        if bm_for.lower().strip() == "all" and model_path not in bm.get("except", []):
-                            base_model = bm.get("with")
-                    elif isinstance(bm_for, list):
-                        if model_path in bm_for:
-                            base_model = bm.get("with")
-                    else:
-                        raise SyntaxError("'" + reader.OVERRIDE_BASE_MODEL_KEY + "' is not formatted properly.")
-                else:
-                    raise SyntaxError("The 'for' attribute is required in the '" +
-                                      reader.OVERRIDE_BASE_MODEL_KEY +
-                                      "'option.")
-        return base_model
+        return self.override_indexes[reader.OVERRIDE_BASE_MODEL_KEY].get(model_path, base_model)
 
     def _get_base_mschema_from_options(self, mschema_name, model_schema=True, namespace=None, version=None):
-        schemas_path_key = utils.replace_template_var(self.options[reader.SCHEMAS_PATH_KEY],
-                                                      namespace=namespace,
-                                                      version=version)
-        schema_path = schemas_path_key.replace("/", ".").replace(".py", "") + "." + mschema_name
+        schema_path = self._get_override_path(reader.SCHEMAS_PATH_KEY, mschema_name, namespace=namespace, version=version)
         base_mschema = self.options[reader.DEFAULT_BASE_MODEL_SCHEMA_KEY] if model_schema else self.options[reader.DEFAULT_BASE_SCHEMA_KEY]
-        overridden_base_schemas = self.options[reader.OVERRIDE_BASE_SCHEMA_KEY]
-
-        for bs in overridden_base_schemas:
-            if bs:
-                bs_for = bs.get("for")
-                if bs_for:
-                    if isinstance(bs_for, str):
-                        if bs_for.lower().strip() == "all" and schema_path not in bs.get("except", []):
-                            base_mschema = bs.get("with")
-                    elif isinstance(bs_for, list):
-                        if schema_path in bs_for:
-                            base_mschema = bs.get("with")
-                    else:
-                        raise SyntaxError("'" + reader.OVERRIDE_BASE_SCHEMA_KEY + "' is not formatted properly.")
-                else:
-                    raise SyntaxError("The 'for' attribute is required in the '" +
-                                      reader.OVERRIDE_BASE_SCHEMA_KEY +
-                                      "'option.")
-        return base_mschema
+        return self.override_indexes[reader.OVERRIDE_BASE_SCHEMA_KEY].get(schema_path, base_mschema)
 
     def _get_base_controller_from_options(self, controller_name, controller_type=None, namespace=None, version=None):
-        controllers_path_key = utils.replace_template_var(self.options[reader.CONTROLLERS_PATH_KEY],
-                                                          namespace=namespace,
-                                                          version=version)
-        controller_path = controllers_path_key.replace("/", ".").replace(".py", "") + "." + controller_name
+        controller_path = self._get_override_path(reader.CONTROLLERS_PATH_KEY,
+                                                  controller_name,
+                                                  namespace=namespace,
+                                                  version=version)
 
         if controller_type == ControllerType.ITEM.value[1]:
             base_controller = self.options[reader.DEFAULT_BASE_ITEM_CONTROLLER_KEY]
@@ -1010,25 +1330,44 @@ class Compiler(object):
         else:
             base_controller = self.options[reader.DEFAULT_BASE_CONTROLLER_KEY]
 
-        overridden_base_controllers = self.options[reader.OVERRIDE_BASE_CONTROLLER_KEY]
-
-        for bc in overridden_base_controllers:
-            if bc:
-                bc_for = bc.get("for")
-                if bc_for:
-                    if isinstance(bc_for, str):
-                        if bc_for.lower().strip() == "all" and controller_path not in bc.get("except", []):
-                            base_controller = bc.get("with")
-                    elif isinstance(bc_for, list):
-                        if controller_path in bc_for:
-                            base_controller = bc.get("with")
-                    else:
-                        raise SyntaxError("'" + reader.OVERRIDE_BASE_CONTROLLER_KEY + "' is not formatted properly.")
-                else:
-                    raise SyntaxError("The 'for' attribute is required in the '" +
-                                      reader.OVERRIDE_BASE_CONTROLLER_KEY +
-                                      "'option.")
-        return base_controller
+        return self.override_indexes[reader.OVERRIDE_BASE_CONTROLLER_KEY].get(controller_path, base_controller)
+
+    def _get_override_path(self, path_key, name, namespace=None, version=None):
+        """
+        Gets the dotted path that OVERRIDE_* options use to refer to a model, schema or controller, e.g.
+        models.default.Pet. The module part only depends on the namespace, so it is rendered once per namespace.
+        """
+        module_key = (path_key, namespace, version)
+        module_path = self._override_module_paths.get(module_key)
+        if module_path is None:
+            module_path = utils.replace_template_var(self.options[path_key], namespace=namespace, version=version)
+            module_path = module_path.replace("/", ".").replace(".py", "")
+            self._override_module_paths[module_key] = module_path
+        return module_path + "." + name
+
+    def _index_overrides(self):
+        """
+        Validates the OVERRIDE_* options once and indexes them by path. All malformed entries are reported together.
+        """
+        self.override_indexes = {
+            reader.OVERRIDE_BASE_MODEL_KEY: OverrideIndex(reader.OVERRIDE_BASE_MODEL_KEY,
+                                                          self.options[reader.OVERRIDE_BASE_MODEL_KEY]),
+            reader.OVERRIDE_BASE_SCHEMA_KEY: OverrideIndex(reader.OVERRIDE_BASE_SCHEMA_KEY,
+                                                           self.options[reader.OVERRIDE_BASE_SCHEMA_KEY]),
+            reader.OVERRIDE_BASE_CONTROLLER_KEY: OverrideIndex(reader.OVERRIDE_BASE_CONTROLLER_KEY,
+                                                               self.options[reader.OVERRIDE_BASE_CONTROLLER_KEY]),
+            reader.OVERRIDE_TABLE_NAMES_KEY: OverrideIndex(reader.OVERRIDE_TABLE_NAMES_KEY,
+                                                           self.options[reader.OVERRIDE_TABLE_NAMES_KEY],
+                                                           allow_all=False),
+            reader.OVERRIDE_DB_SCHEMA_NAMES_KEY: OverrideIndex(reader.OVERRIDE_DB_SCHEMA_NAMES_KEY,
+                                                               self.options[reader.OVERRIDE_DB_SCHEMA_NAMES_KEY],
+                                                               allow_all=False)
+        }
+
+        errors = [error for index in self.override_indexes.values() for error in index.errors]
+        if errors:
+            raise SyntaxError("The mechanic file has malformed override options:\n" +
+                              "\n".join("  - " + error for error in errors))
 
     def _get_model_path_from_options(self, namespace=None, version=None):
         models_path_key = utils.replace_template_var(self.options[reader.MODELS_PATH_KEY],
@@ -1048,11 +1387,14 @@ class Compiler(object):
                                                           version=version)
         return controllers_path_key.strip(".py").replace("/", ".")
 
+    def _get_tablename_noun(self, model_name):
+        return model_name.replace("-", "").replace("_", "")
+
     def _init_model(self, model_name):
         return {
             "columns": {},
             "relationships": {},
-            "db_tablename": engine.plural_noun(model_name.replace("-", "").replace("_", "")).lower(),
+            "db_tablename": plural_noun(self._get_tablename_noun(model_name)).lower(),
             "db_schema": self.options[reader.DEFAULT_NAMESPACE_KEY],
             "namespace": self.options[reader.DEFAULT_NAMESPACE_KEY],
             "comment": model_name,
@@ -1096,13 +1438,10 @@ class Compiler(object):
     def _follow_reference_link(self, ref):
         """
         Gets a referenced object.
-        :param ref: reference link, example: #/components/schemas/Pet
+        :param ref: reference link, example: #/components/schemas/Pet or #/components/schemas/Pet/properties/name
         :return: dictionary representation of the referenced object
         """
         is_link_in_current_file = True if ref.startswith("#/") else False
 
         if is_link_in_current_file:
-            section = ref.split("/")[-3]
-            object_type = ref.split("/")[-2]
-            resource_name = ref.split("/")[-1]
-            return self.oapi_obj[section][object_type][resource_name]
+            return self.pointer_index.resolve(ref)
@@ -1,20 +1,32 @@
 # native python
 import os
+import re
 import datetime
 import pkg_resources
 import shutil
 import json
 import datetime as dt
 import errno
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 # third party
 import yaml
-import jinja2
 
 # project
-from mechanic.src import reader
+from mechanic.src import reader, templates
+from mechanic.src.merger import Merger
+from mechanic.src.profiler import Profiler, profile_stage
 import mechanic.src.utils as utils
 
+# manifest in the app directory of the files that are copied or rendered from mechanic's own files
+ASSETS_MANIFEST = ".mechanic-assets.json"
+ASSETS_MANIFEST_VERSION = 1
+
+# header of generated files, the timestamp in it is ignored when deciding whether a file changed.
+GENERATED_AT_REGEX = re.compile(r"generated code at UTC [^#\n]*")
+
 
 # Taken from https://stackoverflow.com/questions/23793987/python-write-file-to-directory-doesnt-exist
 def mkdir_p(path):
@@ -34,10 +46,51 @@ def safe_open_w(path):
     return open(path, 'w')
 
 
+_worker_generator = None
+
+
+def _init_worker(generator):
+    global _worker_generator
+    _worker_generator = generator
+
+
+def _render_namespaces_in_worker(namespace_files):
+    if _worker_generator.profiler is not None:
+        _worker_generator.profiler = Profiler(top_schemas=_worker_generator.profiler.top_schemas)
+    return [_worker_generator._render_namespace(*item) for item in namespace_files], _worker_generator.profiler
+
+
 class Generator(object):
-    def __init__(self, directory, mech_obj, options=None):
+    """
+    Generates the code for an app from the mechanic object built by the Compiler. oapi_obj is the merged spec, which is
+    served as the API docs; if it is not given, the spec at mech_obj["openapi_file_location"] is merged again.
+
+    If directory is None, nothing is written. Instead, the rendered files are kept in self.files, a dictionary of path
+    (relative to the app directory) to file contents. Static files that are copied as they are (the swagger ui assets,
+    requirements.txt and the unmodified files of the mechanic base package) are not included.
+
+    Files that are already in the directory are only written again if their contents changed, not counting the timestamp
+    in their header. self.file_changes maps the path of each generated file to whether it was written.
+
+    With jobs > 1, the models, schemas and controllers files of the namespaces are rendered in a pool of worker processes.
+    The files are still written one after another in the order of the namespaces, so the output is the same.
+
+    With a profiler, the time spent on each kind of file and the number of files written are recorded in it.
+    """
+    def __init__(self, directory, mech_obj, options=None, oapi_obj=None, profiler=None, jobs=1):
         self.directory = directory
+        self.profiler = profiler
+        self.jobs = jobs
         self.mech_obj = mech_obj
+        self.oapi_obj = oapi_obj
+        self.files = OrderedDict() if directory is None else None
+        self.file_changes = OrderedDict()
+        self._namespace_groups = None
+        self._package_dirs = OrderedDict()
+        # paths of the files that are copied from mechanic's own folders, also when they are not kept in self.files
+        self._copied_files = set()
+        self._assets_manifest = None
+        self._saved_assets_manifest = None
         self.options = options
 
         self.TEMPLATE_DIR = "../templates/"
@@ -47,7 +100,8 @@ class Generator(object):
         controllers_path = self.options[reader.CONTROLLERS_PATH_KEY]
         schemas_path = self.options[reader.SCHEMAS_PATH_KEY]
 
-        for namespace, obj in self.mech_obj["namespaces"].items():
+        namespace_files = []
+        for namespace in self.mech_obj["namespaces"].keys():
             model_filename = utils.replace_template_var(models_path,
                                                         namespace=namespace,
                                                         version=self.mech_obj["version"])
@@ -59,95 +113,172 @@ class Generator(object):
                                                              namespace=namespace,
                                                              version=self.mech_obj["version"])
 
-            if self.options[reader.EXCLUDE_MODEL_GENERATION_KEY] != "all":
-                self.build_models_file(model_filename, namespace)
-            if self.options[reader.EXCLUDE_SCHEMA_GENERATION_KEY] != "all":
-                self.build_schemas_file(schema_filename, namespace)
-            if self.options[reader.EXCLUDE_CONTROLLER_GENERATION_KEY] != "all":
-                self.build_controllers_file(controller_filename, namespace)
+            namespace_files.append((namespace, model_filename, schema_filename, controller_filename))
+
+        rendered = self._render_namespaces(namespace_files)
+        with profile_stage(self.profiler, "generate.write_namespaces"):
+            for filename, contents in rendered:
+                self._write_if_not_excluded(filename, contents)
 
         # add mechanic folder
         if "mechanic" not in self.options[reader.EXCLUDE_KEY]:
-            self._add_mechanic_base_package()
+            with profile_stage(self.profiler, "generate.mechanic_package"):
+                self._add_mechanic_base_package()
 
         # add starter app files
-        if self.options[reader.APP_NAME_KEY] + "/__init__.py" not in self.options[reader.EXCLUDE_KEY]:
-            self.build_init_app_file()
-        if "run.py" not in self.options[reader.EXCLUDE_KEY]:
-            self._add_run_file()
-        if "requirements.txt" not in self.options[reader.EXCLUDE_KEY]:
-            self._add_requirements_txt()
-        if self.options[reader.APP_NAME_KEY] + "/init_api.py" not in self.options[reader.EXCLUDE_KEY]:
-            self.build_init_api_file()
-        self._add_swagger_docs()
+        with profile_stage(self.profiler, "generate.app_files"):
+            if self.options[reader.APP_NAME_KEY] + "/__init__.py" not in self.options[reader.EXCLUDE_KEY]:
+                self.build_init_app_file()
+            if "run.py" not in self.options[reader.EXCLUDE_KEY]:
+                self._add_run_file()
+            if "requirements.txt" not in self.options[reader.EXCLUDE_KEY]:
+                self._add_requirements_txt()
+            if self.options[reader.APP_NAME_KEY] + "/init_api.py" not in self.options[reader.EXCLUDE_KEY]:
+                self.build_init_api_file()
+
+        with profile_stage(self.profiler, "generate.swagger_docs"):
+            self._add_swagger_docs()
+
+        with profile_stage(self.profiler, "generate.package_files"):
+            self._write_package_files()
+        if self.files is None:
+            self._write_assets_manifest()
+
+        if self.profiler is not None and self.files is None:
+            self.profiler.count("written_files", self.count_written_files())
+            self.profiler.count("unchanged_files", len(self.file_changes) - self.count_written_files())
+
+    def count_written_files(self):
+        """
+        :return: number of generated files that were written, files that did not change are not counted
+        """
+        return sum(1 for changed in self.file_changes.values() if changed)
+
+    def _render_namespaces(self, namespace_files):
+        """
+        Renders the models, schemas and controllers files of each namespace, in a pool of worker processes if jobs > 1.
+        :param namespace_files: list of (namespace, models file name, schemas file name, controllers file name)
+        :return: list of (file name, contents) of the rendered files, in the order of namespace_files
+        """
+        if self.jobs <= 1 or len(namespace_files) <= 1:
+            return [item for namespace in namespace_files for item in self._render_namespace(*namespace)]
+
+        # the worker processes get a copy of the generator without the spec, which is not needed to render the files.
+        worker_generator = Generator(None, self.mech_obj, options=self.options, profiler=self.profiler)
+        size = -(-len(namespace_files) // self.jobs)
+        rendered = []
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker,
+                                 initargs=(worker_generator,)) as executor:
+            for result, worker_profiler in executor.map(_render_namespaces_in_worker,
+                                                        [namespace_files[i:i + size]
+                                                         for i in range(0, len(namespace_files), size)]):
+                for items in result:
+                    rendered.extend(items)
+                if worker_profiler is not None:
+                    self.profiler.merge(worker_profiler)
+        return rendered
+
+    def _render_namespace(self, namespace, model_filename, schema_filename, controller_filename):
+        """
+        :return: list of (file name, contents) of the models, schemas and controllers files of a namespace
+        """
+        rendered = []
+        if self.options[reader.EXCLUDE_MODEL_GENERATION_KEY] != "all":
+            with profile_stage(self.profiler, "generate.models"):
+                rendered.append((model_filename, self._render_models_file(namespace)))
+        if self.options[reader.EXCLUDE_SCHEMA_GENERATION_KEY] != "all":
+            with profile_stage(self.profiler, "generate.schemas"):
+                rendered.append((schema_filename, self._render_schemas_file(namespace)))
+        if self.options[reader.EXCLUDE_CONTROLLER_GENERATION_KEY] != "all":
+            with profile_stage(self.profiler, "generate.controllers"):
+                rendered.append((controller_filename, self._render_controllers_file(namespace)))
+        return [(filename, contents) for filename, contents in rendered if contents is not None]
+
+    def _get_namespace_group(self, namespace):
+        """
+        Gets the objects of a namespace. The objects of all namespaces are grouped on the first call, using the
+        namespaces index of the mechanic object, and keep the order they have in the mechanic object.
+        :return: dictionary of "models", "schemas", "controllers" and "many_to_many" to dictionaries of the objects of
+        that kind in the namespace
+        """
+        if self._namespace_groups is None:
+            self._namespace_groups = dict()
+            for kind in ["models", "schemas", "controllers"]:
+                objs = self.mech_obj[kind]
+                positions = dict((name, i) for i, name in enumerate(objs.keys()))
+
+                for ns, index in self.mech_obj["namespaces"].items():
+                    names = sorted(set(name for name in index[kind] if name in objs and objs[name]["namespace"] == ns),
+                                   key=positions.get)
+                    group = self._namespace_groups.setdefault(ns, {"many_to_many": OrderedDict()})
+                    group[kind] = OrderedDict((name, objs[name]) for name in names)
+
+            # many to many tables are not in the namespaces index
+            for m2m_key, m2m in self.mech_obj["many_to_many"].items():
+                if m2m["namespace"] in self._namespace_groups:
+                    self._namespace_groups[m2m["namespace"]]["many_to_many"][m2m_key] = m2m
+
+        return self._namespace_groups[namespace]
 
     def build_models_file(self, filename, namespace):
-        base_models = dict()
-        namespaced_models = dict()
-        namespaced_many_to_many = dict()
-
-        for model_name, model in self.mech_obj["models"].items():
-            if model["namespace"] == namespace:
-                base_model_path = model["base_model_path"]
-                base_model_name = model["base_model_name"]
+        models_result = self._render_models_file(namespace)
+        if models_result is not None:
+            self._write_if_not_excluded(filename, models_result)
 
-                if not base_models.get(base_model_path):
-                    base_models[base_model_path] = []
+    def _render_models_file(self, namespace):
+        base_models = dict()
+        group = self._get_namespace_group(namespace)
+        namespaced_models = group["models"]
 
-                if base_model_name not in base_models[base_model_path]:
-                    base_models[base_model_path].append(base_model_name)
+        for model_name, model in namespaced_models.items():
+            base_model_path = model["base_model_path"]
+            base_model_name = model["base_model_name"]
 
-                namespaced_models[model_name] = model
+            if not base_models.get(base_model_path):
+                base_models[base_model_path] = []
 
-        for m2m_key, m2m in self.mech_obj["many_to_many"].items():
-            if m2m["namespace"] == namespace:
-                namespaced_many_to_many[m2m_key] = m2m
+            if base_model_name not in base_models[base_model_path]:
+                base_models[base_model_path].append(base_model_name)
 
         if len(namespaced_models):
-            models_result = self._render(pkg_resources.resource_filename(__name__, self.TEMPLATE_DIR + "models.tpl"), context={
+            return self._render(pkg_resources.resource_filename(__name__, self.TEMPLATE_DIR + "models.tpl"), context={
                 "timestamp": dt.datetime.utcnow(),
                 "app_name": self.options[reader.APP_NAME_KEY],
                 "base_models": base_models,
                 "models": namespaced_models,
-                "many_to_many": namespaced_many_to_many
+                "many_to_many": group["many_to_many"]
             })
 
-            module_paths = dict()
-            for k, v in namespaced_models.items():
-                if not module_paths.get(v["module_path"]):
-                    module_paths[v["module_path"]] = []
-                module_paths[v["module_path"]].append(k)
-
-            self._write_if_not_excluded(filename, models_result)
-
     def build_schemas_file(self, filename, namespace):
+        schemas_result = self._render_schemas_file(namespace)
+        if schemas_result is not None:
+            self._write_if_not_excluded(filename, schemas_result)
+
+    def _render_schemas_file(self, namespace):
         base_schemas = dict()
-        namespaced_schemas = dict()
+        namespaced_schemas = self._get_namespace_group(namespace)["schemas"]
         dependent_models = dict()
 
-        for schema_name, schema in self.mech_obj["schemas"].items():
-            if schema["namespace"] == namespace:
-                base_schema_path = schema["base_schema_path"]
-                base_schema_name = schema["base_schema_name"]
+        for schema_name, schema in namespaced_schemas.items():
+            base_schema_path = schema["base_schema_path"]
+            base_schema_name = schema["base_schema_name"]
 
-                schema_model = schema["model"]
-                if schema_model:
-                    path = self.mech_obj["models"][schema_model]["module_path"]
+            schema_model = schema["model"]
+            if schema_model:
+                path = self.mech_obj["models"][schema_model]["module_path"]
 
-                    if not dependent_models.get(path):
-                        dependent_models[path] = []
-                    dependent_models[path].append(schema_model)
+                if not dependent_models.get(path):
+                    dependent_models[path] = []
+                dependent_models[path].append(schema_model)
 
-                if not base_schemas.get(base_schema_path):
-                    base_schemas[base_schema_path] = []
+            if not base_schemas.get(base_schema_path):
+                base_schemas[base_schema_path] = []
 
-                if base_schema_name not in base_schemas[base_schema_path]:
-                    base_schemas[base_schema_path].append(base_schema_name)
-
-                namespaced_schemas[schema_name] = schema
+            if base_schema_name not in base_schemas[base_schema_path]:
+                base_schemas[base_schema_path].append(base_schema_name)
 
         if len(namespaced_schemas):
-            schemas_result = self._render(pkg_resources.resource_filename(__name__, self.TEMPLATE_DIR + "schemas.tpl"), context={
+            return self._render(pkg_resources.resource_filename(__name__, self.TEMPLATE_DIR + "schemas.tpl"), context={
                 "timestamp": dt.datetime.utcnow(),
                 "app_name": self.options[reader.APP_NAME_KEY],
                 "base_schemas": base_schemas,
@@ -155,62 +286,62 @@ class Generator(object):
                 "dependent_models": dependent_models
             })
 
-            self._write_if_not_excluded(filename, schemas_result)
-
     def build_controllers_file(self, filename, namespace):
+        result = self._render_controllers_file(namespace)
+        if result is not None:
+            self._write_if_not_excluded(filename, result)
+
+    def _render_controllers_file(self, namespace):
         base_controllers = dict()
-        namespaced_controllers = dict()
+        namespaced_controllers = self._get_namespace_group(namespace)["controllers"]
         dependent_models = dict()
         dependent_schemas = dict()
 
-        for controller_name, controller in self.mech_obj["controllers"].items():
-            if controller["namespace"] == namespace:
-                base_controller_path = controller["base_controller_path"]
-                base_controller_name = controller["base_controller_name"]
-
-                resource = controller["resource"]
+        for controller_name, controller in namespaced_controllers.items():
+            base_controller_path = controller["base_controller_path"]
+            base_controller_name = controller["base_controller_name"]
 
-                model = self.mech_obj["resources"].get(resource, {}).get("model")
-                schema = self.mech_obj["resources"].get(resource, {}).get("schema")
-                request_schemas = [controller.get("requests", {}).get("post", {}).get("schema"),
-                                   controller.get("requests", {}).get("put", {}).get("schema"),
-                                   controller.get("requests", {}).get("delete", {}).get("schema"),
-                                   controller.get("requests", {}).get("get", {}).get("schema")]
-                request_schemas = [item for item in request_schemas if item]
+            resource = controller["resource"]
 
-                if model:
-                    model_path = self.mech_obj["models"][model]["module_path"]
+            model = self.mech_obj["resources"].get(resource, {}).get("model")
+            schema = self.mech_obj["resources"].get(resource, {}).get("schema")
+            request_schemas = [controller.get("requests", {}).get("post", {}).get("schema"),
+                               controller.get("requests", {}).get("put", {}).get("schema"),
+                               controller.get("requests", {}).get("delete", {}).get("schema"),
+                               controller.get("requests", {}).get("get", {}).get("schema")]
+            request_schemas = [item for item in request_schemas if item]
 
-                    if not dependent_models.get(model_path):
-                        dependent_models[model_path] = []
+            if model:
+                model_path = self.mech_obj["models"][model]["module_path"]
 
-                    if model not in dependent_models[model_path]:
-                        dependent_models[model_path].append(model)
+                if not dependent_models.get(model_path):
+                    dependent_models[model_path] = []
 
-                if schema:
-                    schema_path = self.mech_obj["schemas"][schema]["module_path"]
+                if model not in dependent_models[model_path]:
+                    dependent_models[model_path].append(model)
 
-                    if not dependent_schemas.get(schema_path):
-                        dependent_schemas[schema_path] = []
+            if schema:
+                schema_path = self.mech_obj["schemas"][schema]["module_path"]
 
-                    if schema not in dependent_schemas[schema_path]:
-                        dependent_schemas[schema_path].append(schema)
+                if not dependent_schemas.get(schema_path):
+                    dependent_schemas[schema_path] = []
 
-                    for item in request_schemas:
-                        request_schema_path = self.mech_obj["schemas"][schema]["module_path"]
-                        if item not in dependent_schemas[request_schema_path]:
-                            dependent_schemas[request_schema_path].append(item)
+                if schema not in dependent_schemas[schema_path]:
+                    dependent_schemas[schema_path].append(schema)
 
-                if not base_controllers.get(base_controller_path):
-                    base_controllers[base_controller_path] = []
+                for item in request_schemas:
+                    request_schema_path = self.mech_obj["schemas"][schema]["module_path"]
+                    if item not in dependent_schemas[request_schema_path]:
+                        dependent_schemas[request_schema_path].append(item)
 
-                if base_controller_name not in base_controllers[base_controller_path]:
-                    base_controllers[base_controller_path].append(base_controller_name)
+            if not base_controllers.get(base_controller_path):
+                base_controllers[base_controller_path] = []
 
-                namespaced_controllers[controller_name] = controller
+            if base_controller_name not in base_controllers[base_controller_path]:
+                base_controllers[base_controller_path].append(base_controller_name)
 
         if len(namespaced_controllers):
-            result = self._render(pkg_resources.resource_filename(__name__, self.TEMPLATE_DIR + "controllers.tpl"), context={
+            return self._render(pkg_resources.resource_filename(__name__, self.TEMPLATE_DIR + "controllers.tpl"), context={
                 "timestamp": dt.datetime.utcnow(),
                 "app_name": self.options[reader.APP_NAME_KEY],
                 "base_controllers": base_controllers,
@@ -219,8 +350,6 @@ class Generator(object):
                 "dependent_schemas": dependent_schemas,
             })
 
-            self._write_if_not_excluded(filename, result)
-
     def build_init_app_file(self):
         dependent_controllers = dict()
 
@@ -241,9 +370,7 @@ class Generator(object):
             "db_url": self.options[reader.DATABASE_URL_KEY]
         })
 
-        app_name = self.options[reader.APP_NAME_KEY]
-        with safe_open_w(self.directory + "/" + app_name + "/__init__.py") as f:
-            f.write(result)
+        self._write_file(self.options[reader.APP_NAME_KEY] + "/__init__.py", result)
 
     def build_init_api_file(self):
         dependent_controllers = dict()
@@ -277,115 +404,279 @@ class Generator(object):
             "db_url": self.options[reader.DATABASE_URL_KEY]
         })
 
-        app_name = self.options[reader.APP_NAME_KEY]
-        with safe_open_w(self.directory + "/" + app_name + "/init_api.py") as f:
-            f.write(result)
+        self._write_file(self.options[reader.APP_NAME_KEY] + "/init_api.py", result)
 
     def _write_if_not_excluded(self, filename, contents):
         if filename not in self.options[reader.EXCLUDE_KEY]:
             self._add_package_files(filename)
-            with safe_open_w(self.directory + "/" + filename) as f:
-                f.write(contents)
+            self._write_file(filename, contents)
 
     def _add_run_file(self):
-        self._replace_app_name_in_file(pkg_resources.resource_filename(__name__, "../mechanic/run.py"),
-                                       self.directory + "/run.py")
+        self._replace_app_name_in_file(pkg_resources.resource_filename(__name__, "../mechanic/run.py"), "run.py")
 
     def _add_requirements_txt(self):
-        shutil.copy(pkg_resources.resource_filename(__name__, "../mechanic/requirements.txt"),
-                    self.directory + "/requirements.txt")
+        self._copy_asset(pkg_resources.resource_filename(__name__, "../mechanic/requirements.txt"), "requirements.txt",
+                         overwrite=True)
 
     def _add_mechanic_base_package(self):
         mechanic_folder = pkg_resources.resource_filename(__name__, "../mechanic/base/")
         mechanic_utils_folder = pkg_resources.resource_filename(__name__, "../mechanic/utils/")
 
-        try:
-            shutil.copytree(mechanic_folder, self.directory + "/mechanic/base/")
-            self._add_package_files("mechanic/base/")
-        except FileExistsError as e:
-            pass
+        # the files that have the app name in them are rendered below instead of copied.
+        self._copy_tree(mechanic_folder, "mechanic/base/", exclude=["schemas.py", "models.py", "controllers.py"])
+        self._add_package_files("mechanic/base/")
 
-        try:
-            shutil.copytree(mechanic_utils_folder, self.directory + "/mechanic/utils/")
-            self._add_package_files("mechanic/utils/")
-        except FileExistsError as e:
-            pass
+        self._copy_tree(mechanic_utils_folder, "mechanic/utils/", exclude=["db_helper.py"])
+        self._add_package_files("mechanic/utils/")
 
         self._replace_app_name_in_file(pkg_resources.resource_filename(__name__, "../mechanic/base/schemas.py"),
-                                       self.directory + "/mechanic/base/schemas.py")
+                                       "mechanic/base/schemas.py")
         self._replace_app_name_in_file(pkg_resources.resource_filename(__name__, "../mechanic/base/models.py"),
-                                       self.directory + "/mechanic/base/models.py")
+                                       "mechanic/base/models.py")
         self._replace_app_name_in_file(pkg_resources.resource_filename(__name__, "../mechanic/base/controllers.py"),
-                                       self.directory + "/mechanic/base/controllers.py")
+                                       "mechanic/base/controllers.py")
         self._replace_app_name_in_file(pkg_resources.resource_filename(__name__, "../mechanic/utils/db_helper.py"),
-                                       self.directory + "/mechanic/utils/db_helper.py")
+                                       "mechanic/utils/db_helper.py")
 
     def _add_swagger_docs(self):
         static_folder = pkg_resources.resource_filename(__name__, "../mechanic/app/static")
         templates_folder = pkg_resources.resource_filename(__name__, "../mechanic/app/templates")
+        app_name = self.options[reader.APP_NAME_KEY]
 
-        try:
-            shutil.copytree(static_folder, self.directory + "/" + self.options[reader.APP_NAME_KEY] + "/static")
-        except FileExistsError:
-             pass
-        try:
-            shutil.copytree(templates_folder, self.directory + "/" + self.options[reader.APP_NAME_KEY] + "/templates")
-            output_file = self.directory + "/" + self.options[reader.APP_NAME_KEY] + "/templates/index.html"
+        self._copy_tree(static_folder, app_name + "/static")
+        self._copy_tree(templates_folder, app_name + "/templates", exclude=["index.html"])
 
-            with open(output_file) as f:
+        def write_index():
+            with open(templates_folder + "/index.html") as f:
                 contents = f.read()
+            self._write_file(app_name + "/templates/index.html", contents.replace("API_TITLE", self.mech_obj["title"]))
+
+        self._sync_asset(templates_folder + "/index.html", app_name + "/templates/index.html", write_index,
+                         inputs=self.mech_obj["title"])
+
+        # the merged specification file is served as the API docs.
+        oapi_obj = self.oapi_obj
+        if oapi_obj is None:
+            merger = Merger(self.mech_obj["openapi_file_location"], None)
+            merger.merge()
+            oapi_obj = merger.oapi_obj
+        self._write_docs(app_name + "/static/docs.yaml", oapi_obj)
+
+    def _write_docs(self, path, oapi_obj):
+        """
+        Writes the spec as yaml, unless the file is up to date. Dumping a large spec to yaml takes seconds, so the assets
+        manifest records a hash of the spec (which is much faster to compute) and the size and modification time of the
+        file once it was written. The file is up to date if none of these changed.
+        """
+        if self.files is not None:
+            self._write_file(path, utils.serialize_to_string(oapi_obj, "docs.yaml"))
+            return
+
+        path = os.path.normpath(path)
+        manifest = self._get_assets_manifest()
+        entry = manifest.get(path, {})
+        key = hashlib.sha256(json.dumps(oapi_obj, default=str).encode("utf-8")).hexdigest()
+
+        stat = self._get_stat(self.directory + "/" + path)
+        if stat is not None and entry.get("stat") == stat and entry.get("key") == key:
+            self.file_changes.setdefault(path, False)
+        else:
+            self._write_file(path, utils.serialize_to_string(oapi_obj, "docs.yaml"))
+            manifest[path] = {"key": key, "stat": self._get_stat(self.directory + "/" + path)}
+
+    def _add_package_files(self, path):
+        """
+        Marks the folders of a generated file as python packages. Their __init__.py files are created at the end of
+        the build, by _write_package_files.
+        """
+        dirs = path.split("/")
+        for i, dir in enumerate(dirs):
+            dir_path = "/".join(dirs[:(i + 1)])
+            if dir_path and not dir_path.endswith(".py"):
+                self._package_dirs[os.path.normpath(dir_path)] = True
+
+    def _write_package_files(self):
+        """
+        Creates the __init__.py files that are missing in the package folders of the generated files. Folders that are
+        copied from mechanic's own folders already have theirs.
+        """
+        for dir_path in self._package_dirs:
+            path = os.path.normpath(dir_path + "/__init__.py")
+            if path in self._copied_files:
+                continue
+
+            if self.files is not None:
+                exists = path in self.files
+            else:
+                exists = os.path.exists(self.directory + "/" + path)
 
-            with open(output_file, "w") as f:
-                contents = contents.replace("API_TITLE", self.mech_obj["title"])
-                f.write(contents)
-        except FileExistsError:
-            pass
+            if not exists:
+                self._write_file(path, "")
+            elif self.files is None:
+                self.file_changes.setdefault(path, False)
 
+    def _replace_app_name_in_file(self, src_file, output_file):
+        def write():
+            # replace app_name var
+            result = self._render(src_file, context={
+                "timestamp": dt.datetime.utcnow(),
+                "app_name": self.options[reader.APP_NAME_KEY]
+            })
 
-        # temp.yaml is the merged specification file generated from the compiler. Copy this to the static folder and
-        # then delete the temp.yaml file
-        oapi_file_location = self.directory + "/temp.yaml"
-        shutil.copy(oapi_file_location, self.directory + "/" + self.options[reader.APP_NAME_KEY] + "/static/docs.yaml")
-        os.remove(oapi_file_location)
+            self._write_file(output_file, result)
+
+        self._sync_asset(src_file, output_file, write, inputs=self.options[reader.APP_NAME_KEY], overwrite=True)
+
+    def _write_file(self, path, contents):
+        """
+        Writes a generated file if it changed, or keeps it in self.files if the generator does not write to a directory.
+        :param path: path of the file, relative to the app directory
+        :param contents: file contents
+        """
+        if self.profiler is not None:
+            self.profiler.count("rendered_files")
+
+        if self.files is not None:
+            self.files[os.path.normpath(path)] = contents
+            return
+
+        path = os.path.normpath(path)
+        current_contents = self._read_file(path)
+        if current_contents is not None and \
+                GENERATED_AT_REGEX.sub("", current_contents) == GENERATED_AT_REGEX.sub("", contents):
+            self.file_changes.setdefault(path, False)
+            return
+
+        with safe_open_w(self.directory + "/" + path) as f:
+            f.write(contents)
+        self.file_changes[path] = True
+
+    def _read_file(self, path):
+        """
+        :param path: path of a file, relative to the app directory
+        :return: contents of a file that was generated, or None if it does not exist
+        """
+        if self.files is not None:
+            return self.files.get(os.path.normpath(path))
 
-    def _add_package_files(self, path, imports=None):
-        dirs = path.split("/")
-        dir_path = []
-        for i, dir in enumerate(dirs):
-            dir_path.append("/".join(dirs[:(i+1)]))
-
-        for dir in dir_path:
-            if not dir.endswith(".py"):
-                import_result = imports
-                if imports:
-                    import_result = self._render(
-                        pkg_resources.resource_filename(__name__, self.TEMPLATE_DIR + "init_models.tpl"),
-                        context={
-                            "module_paths": imports
-                        })
-                if not os.path.exists(self.directory + "/" + dir + "/__init__.py"):
-                    with safe_open_w(self.directory + "/" + dir + "/__init__.py") as f:
-                        if import_result:
-                            f.write(import_result)
-                else:
-                    with open(self.directory + "/" + dir + "/__init__.py", "r") as f:
-                        current_contents = f.read()
-
-                    with open(self.directory + "/" + dir + "/__init__.py", "a") as f:
-                        if import_result and import_result not in current_contents:
-                            f.write(import_result)
+        try:
+            with open(self.directory + "/" + path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _copy_tree(self, src, path, exclude=None):
+        """
+        Copies a folder of static files into the app directory, file by file, see _copy_asset.
+        :param exclude: paths of files, relative to src, that are not copied
+        """
+        for dir_path, dir_names, file_names in os.walk(src):
+            dir_names[:] = sorted(name for name in dir_names if name != "__pycache__")
+
+            for file_name in sorted(file_names):
+                relative_path = os.path.relpath(os.path.join(dir_path, file_name), src)
+                if not file_name.endswith(".pyc") and relative_path not in (exclude or []):
+                    self._copied_files.add(os.path.normpath(os.path.join(path, relative_path)))
+                    self._copy_asset(os.path.join(dir_path, file_name), os.path.join(path, relative_path))
+
+    def _copy_asset(self, src_file, path, overwrite=False):
+        """
+        Copies a static file into the app directory, see _sync_asset. Static files are not kept in self.files if the
+        generator does not write to a directory.
+        """
+        if self.files is not None:
+            return
+
+        def copy():
+            mkdir_p(os.path.dirname(self.directory + "/" + path))
+            shutil.copyfile(src_file, self.directory + "/" + path)
+            self.file_changes[os.path.normpath(path)] = True
+
+        self._sync_asset(src_file, path, copy, overwrite=overwrite)
+
+    def _sync_asset(self, src_file, path, write, inputs="", overwrite=False):
+        """
+        Writes a file that is made from one of mechanic's own files, unless it is up to date. The assets manifest in the
+        app directory records, for each of these files, the hash of the file it was made from and the size and
+        modification time it had once it was written. A file is up to date if neither changed since. A file that was
+        modified in the app directory is kept as it is, unless overwrite is set. A file that has no manifest entry, e.g.
+        because it was copied by a version of mechanic without the manifest, is recorded as it is if it is a copy of the
+        source file, and written again otherwise. The source file is only read to hash it if its own size or modification
+        time changed.
+        :param src_file: path of the mechanic file
+        :param path: path of the file, relative to the app directory
+        :param write: function that writes the file
+        :param inputs: string with anything else the contents of the file depend on, e.g. the app name
+        :param overwrite: write the file even if it was modified in the app directory
+        """
+        if self.files is not None:
+            write()
+            return
+
+        path = os.path.normpath(path)
+        manifest = self._get_assets_manifest()
+        entry = manifest.get(path, {})
+
+        src_stat = self._get_stat(src_file)
+        if entry.get("source_stat") == src_stat:
+            src_hash = entry["source_hash"]
+        else:
+            with open(src_file, "rb") as f:
+                src_hash = hashlib.sha256(f.read()).hexdigest()
+        key = hashlib.sha256((src_hash + "\n" + inputs).encode("utf-8")).hexdigest()
+
+        stat = self._get_stat(self.directory + "/" + path)
+        if stat is None:
+            stale = True
+        elif entry.get("key") is None:
+            with open(self.directory + "/" + path, "rb") as f:
+                stale = hashlib.sha256(f.read()).hexdigest() != src_hash
+            entry = {"key": key, "stat": stat}
+        elif entry.get("stat") == stat:
+            stale = entry.get("key") != key
+        else:
+            stale = overwrite
 
-    def _replace_app_name_in_file(self, src_file, output_file):
-        # replace app_name var
-        result = self._render(src_file, context={
-            "timestamp": dt.datetime.utcnow(),
-            "app_name": self.options[reader.APP_NAME_KEY]
-        })
+        if stale:
+            write()
+            entry = {"key": key, "stat": self._get_stat(self.directory + "/" + path)}
+        else:
+            self.file_changes.setdefault(path, False)
+
+        manifest[path] = {"source_stat": src_stat, "source_hash": src_hash, "key": entry.get("key"),
+                          "stat": entry.get("stat")}
 
-        with safe_open_w(output_file) as f:
-            f.write(result)
+    def _get_stat(self, file_path):
+        """
+        :return: [size, modification time in nanoseconds] of a file, or None if it does not exist
+        """
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _get_assets_manifest(self):
+        if self._assets_manifest is None:
+            self._assets_manifest = dict()
+            try:
+                with open(self.directory + "/" + ASSETS_MANIFEST) as f:
+                    manifest = json.load(f)
+                if manifest.get("version") == ASSETS_MANIFEST_VERSION:
+                    self._assets_manifest = manifest["assets"]
+            except (OSError, ValueError):
+                # a missing or unreadable manifest only means every asset is checked again
+                pass
+            self._saved_assets_manifest = json.dumps(self._assets_manifest, sort_keys=True)
+        return self._assets_manifest
+
+    def _write_assets_manifest(self):
+        if self._assets_manifest is None or json.dumps(self._assets_manifest, sort_keys=True) == \
+                self._saved_assets_manifest:
+            return
+
+        with safe_open_w(self.directory + "/" + ASSETS_MANIFEST) as f:
+            json.dump({"version": ASSETS_MANIFEST_VERSION, "assets": self._assets_manifest}, f, sort_keys=True)
 
     def _render(self, tpl_path, context):
-        path, filename = os.path.split(tpl_path)
-        return jinja2.Environment(loader=jinja2.FileSystemLoader(path or "./")).get_template(filename).render(
-            context)
+        return templates.render(tpl_path, context)
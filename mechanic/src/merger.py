@@ -1,16 +1,22 @@
 import os
 import re
-import ast
 import json
 import shutil
 import copy
+import pickle
+import hashlib
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-import yaml
-import yamlordereddictloader
-from yamlordereddictloader import OrderedDict
+import mechanic.src.utils as utils
+from mechanic.src.cache import DocumentCache
+from mechanic.src.pointer import PointerIndex, unescape
 
 
 EXTENSION_PUBLIC = "x-mechanic-public"
+MECHANIC_EXTENSIONS = ["x-mechanic-controller", "x-mechanic-tags", "x-mechanic-db", "x-mechanic-schema",
+                       "x-mechanic-public", "x-mechanic-embeddable", "x-mechanic-model"]
+ROOT_REFERENCE = "#"
 
 
 class Merger:
@@ -19,21 +25,43 @@ class Merger:
     to an external document like this:
     $ref: cars/wheel.yaml#wheel
     mechanic will merge the reference to that schema into the original file, and then save a copy.
+
+    Referenced files are parsed through document_cache, which can be shared with other Mergers in the same run. With
+    jobs > 1, all referenced files are found up front and parsed in a pool of that many worker processes before the
+    references are resolved.
+
+    The spec can also be passed in as oapi_obj, in which case it is merged in place and oapi_file is only used to find
+    referenced files (relative to the current directory if oapi_file is None).
     """
     root_dir = ""
-    EXTERNAL_SCHEMA_REGEX = "['\"]\$ref['\"]:\s['\"](?:\w|/)*\.(?:json|yaml|yml)#[/\w]*['\"]"
+    # references to files, not including remote references such as "https://host/common.yaml#/Foo", which are left as
+    # they are.
+    EXTERNAL_REF_REGEX = re.compile(r"^(?![a-zA-Z][a-zA-Z0-9+.-]*://)[^#]+\.(?:json|yaml|yml)#")
 
-    def __init__(self, oapi_file, output_file):
+    def __init__(self, oapi_file, output_file, document_cache=None, jobs=1, compact=False, oapi_obj=None):
         self.oapi_file = oapi_file
-        self.oapi_obj = self._deserialize_file()
+        self.document_cache = document_cache if document_cache is not None else DocumentCache()
+        self.jobs = jobs
+        self.compact = compact
+        if oapi_obj is None:
+            self.oapi_obj = self._deserialize_file()
+        else:
+            self.oapi_obj = oapi_obj
+            self.root_dir = os.path.dirname(os.path.realpath(oapi_file)) if oapi_file else os.getcwd()
         self.output_file = output_file
+        self.reference_graph = OrderedDict()
+        self.reference_cycles = []
+        self.pointer_index = None
 
     def merge(self):
         """
         Currently only supports referencing items that will end up in the components/schemas location in the spec file.
+        The merged spec is kept in self.oapi_obj, and is also written to output_file unless output_file is None.
         """
         self._merge_schemas()
-        self._write_to_file()
+        self.pointer_index = PointerIndex(self.oapi_obj)
+        if self.output_file:
+            self._write_to_file()
 
     def _deserialize_file(self):
         """
@@ -41,15 +69,7 @@ class Merger:
         :param oapi_file:
         :return: dictionary representation of the OpenAPI file
         """
-        if self.oapi_file.endswith(".json"):
-            with open(self.oapi_file) as f:
-                oapi = json.load(f)
-        elif self.oapi_file.endswith(".yaml") or self.oapi_file.endswith(".yml"):
-            with open(self.oapi_file) as f:
-                oapi = yaml.load(f)
-        else:
-            raise SyntaxError("File is not of correct format. Must be either json or yaml (and filename extension must "
-                              "one of those too).")
+        oapi = utils.deserialize_file(self.oapi_file)
         self.root_dir = os.path.dirname(os.path.realpath(self.oapi_file))
         return oapi
 
@@ -67,94 +87,301 @@ class Merger:
             return None
 
         if is_link_in_current_file:
-            section = ref.split("/")[-3]
-            object_type = ref.split("/")[-2]
-            resource_name = ref.split("/")[-1]
-            return self.oapi_obj[section][object_type][resource_name], resource_name
+            if self.pointer_index is None:
+                self.pointer_index = PointerIndex(self.oapi_obj)
+            resource_name = unescape(ref.split("/")[-1])
+            return self.pointer_index.resolve(ref), resource_name
         else:
             filename = ref.split("#/")[0]
             object_name = ref.split("#/")[1]
-            data = None
-
-            with open(self.root_dir + "/" + filename) as f:
-                if filename.endswith(".json"):
-                    data = json.load(f)
-                elif filename.endswith(".yaml") or filename.endswith(".yml"):
-                    data = yaml.load(f)
-                else:
-                    raise SyntaxError(
-                        "File is not of correct format. Must be either json or yaml (and filename extension must "
-                        "one of those too).")
+            data = self.document_cache.load(self.root_dir + "/" + filename)
 
-            return data[object_name]
+            # the parsed document is shared through the cache, so hand out a copy that is safe to modify.
+            return copy.deepcopy(data[object_name])
 
     def _write_to_file(self):
         """
         Write the merged data into the specified output file.
         """
-        with open(self.output_file, "w") as f:
-            if self.output_file.endswith(".json"):
-                json_data = json.dumps(self.oapi_obj, indent=3)
-                f.write(json_data)
-            elif self.output_file.endswith(".yaml") or self.output_file.endswith(".yml"):
-                yaml_data = yaml.dump(OrderedDict(self.oapi_obj),
-                                      Dumper=yamlordereddictloader.Dumper,
-                                      default_flow_style=False)
-                f.write(yaml_data)
-            else:
-                raise SyntaxError("Specified output file is not of correct format. Must be either json or yaml.")
+        utils.serialize_to_file(self.oapi_obj, self.output_file, compact=self.compact)
 
     def _merge_schemas(self):
         """
         Merges referenced items into the components/schemas section of the specification file.
+
+        The document is walked once. Each external $ref node is rewritten in place to point at components/schemas, and
+        each distinct reference is followed exactly once no matter how often it appears. Objects pulled in from other
+        files are walked afterwards, because they may hold external references of their own. The edges that were found
+        are kept in self.reference_graph, and any cycles between external objects in self.reference_cycles.
         """
+        if self.jobs > 1:
+            self._preload_external_files()
+
+        schemas = self.oapi_obj["components"]["schemas"]
+        resolved = set()
+        pending = deque([(ROOT_REFERENCE, self.oapi_obj)])
+        self.reference_graph = OrderedDict()
 
-        # convert the master file oapi dictionary into a string
-        oapi_str = str(self.oapi_obj)
-        # find all patterns in the string that match an external reference.
-        matches = re.findall(self.EXTERNAL_SCHEMA_REGEX, oapi_str)
+        while pending:
+            source, source_obj = pending.popleft()
+            self.reference_graph[source] = []
 
-        # as long as there are matches, continue to merge the schemas
-        while len(matches) > 0:
-            for match in matches:
-                reference = match.split(":")[1].replace("'", "").strip(" ")
+            for node in self._find_external_refs(source_obj):
+                reference = node["$ref"]
                 resource_name = reference.split("/")[-1]
-                obj = self.follow_reference_link(reference, remote_only=True)
+                node["$ref"] = "#/components/schemas/" + resource_name
+                self.reference_graph[source].append(reference)
+
+                if reference in resolved:
+                    continue
+                resolved.add(reference)
+
+                # if the object doesn't exist yet in the components/schemas section, add it and walk it later.
+                if not schemas.get(resource_name):
+                    obj = self.follow_reference_link(reference, remote_only=True)
+                    schemas[resource_name] = obj
+                    pending.append((reference, obj))
+
+        self.reference_cycles = self._find_reference_cycles()
+
+    def referenced_files(self):
+        """
+        Gets the external files that objects were merged from. Only valid after merge() has been called.
+        :return: sorted list of absolute file paths
+        """
+        files = set()
+        for reference in self.reference_graph:
+            if reference != ROOT_REFERENCE:
+                files.add(os.path.realpath(self.root_dir + "/" + reference.split("#")[0]))
+        return sorted(files)
+
+    def _preload_external_files(self):
+        """
+        Parses every external file reachable from the spec in a process pool and adds them to the document cache, so
+        that _merge_schemas only gets cache hits. The files are found level by level: first the files referenced by
+        the spec, then the files referenced by those, and so on.
 
-                if obj:
-                    oapi_str = oapi_str.replace(match, '"$ref": "#/components/schemas/' + resource_name + '"')
-                    # convert string back to a dictionary
-                    self.oapi_obj = ast.literal_eval(oapi_str)
+        Files are scanned as a whole, so a file may be preloaded even if none of its referencing objects end up being
+        merged. Such files are allowed to fail here; the error is raised by _merge_schemas if the file is really needed.
+        """
+        seen = set()
+        current = [self.oapi_obj]
+
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            while current:
+                paths = []
+                for obj in current:
+                    for node in self._find_external_refs(obj):
+                        path = os.path.realpath(self.root_dir + "/" + node["$ref"].split("#")[0])
+                        if path not in seen:
+                            seen.add(path)
+                            paths.append(path)
+
+                futures = [(path, executor.submit(utils.deserialize_file, path)) for path in paths]
+                current = []
+                for path, future in futures:
+                    try:
+                        data = future.result()
+                    except Exception:
+                        continue
+                    self.document_cache.put(path, data)
+                    current.append(data)
+
+    def _find_external_refs(self, obj):
+        """
+        Collects every dictionary in obj that has a '$ref' pointing at another file.
+        :param obj: dictionary or list to search
+        :return: list of the dictionaries holding an external '$ref', in document order
+        """
+        found = []
+        stack = [obj]
+
+        while stack:
+            item = stack.pop()
+            if isinstance(item, dict):
+                ref = item.get("$ref")
+                if isinstance(ref, str) and self.EXTERNAL_REF_REGEX.match(ref):
+                    found.append(item)
+                stack.extend(reversed(list(item.values())))
+            elif isinstance(item, list):
+                stack.extend(reversed(item))
+        return found
+
+    def _find_reference_cycles(self):
+        """
+        Finds cycles in self.reference_graph, e.g. car.yaml#/Car -> wheel.yaml#/Wheel -> car.yaml#/Car. Cycles are
+        valid once the references are local, so they are only reported, not rejected.
+        :return: list of cycles, each one a list of references
+        """
+        cycles = []
+        visited = set()
+
+        for start in self.reference_graph:
+            if start in visited:
+                continue
+
+            path = [start]
+            on_path = {start}
+            stack = [iter(self.reference_graph.get(start, []))]
+            visited.add(start)
 
-                    # if the object doesn't exist yet in the components/schemas section, add it.
-                    if not self.oapi_obj["components"]["schemas"].get(resource_name):
-                        self.oapi_obj["components"]["schemas"][resource_name] = obj
+            while stack:
+                target = next(stack[-1], None)
+                if target is None:
+                    stack.pop()
+                    on_path.discard(path.pop())
+                elif target in on_path:
+                    cycles.append(path[path.index(target):] + [target])
+                elif target not in visited:
+                    visited.add(target)
+                    path.append(target)
+                    on_path.add(target)
+                    stack.append(iter(self.reference_graph.get(target, [])))
+        return cycles
 
-                    # set the string object for the next iteration of the loops.
-                    oapi_str = str(self.oapi_obj)
-            # find new matches after current iteration of merging schemas. Some of the merged schemas may have external
-            # references as well, which would required several iterations of the while loop.
-            matches = re.findall(self.EXTERNAL_SCHEMA_REGEX, oapi_str)
 
-def abc(x,y,z):
-    pass
+def _merge_spec_file(args):
+    """
+    Merges a single spec file. Used as the worker function of the SpecMerger process pool, so it has to be picklable.
+    :param args: tuple of (oapi_file, output_file, jobs)
+    :return: tuple of the dictionary representation of the merged spec and the files it references
+    """
+    oapi_file, output_file, jobs = args
+    merger = Merger(oapi_file, output_file, jobs=jobs)
+    merger.merge()
+    return merger.oapi_obj, merger.referenced_files()
+
 
 class SpecMerger:
-    def __init__(self, files_to_merge, master):
+    """
+    Merges many OpenAPI specs into a master spec. Each input spec is merged in memory; with jobs > 1 the input specs are
+    merged in a pool of that many worker processes. The merged copy of each input spec is only written to
+    tmp_merged_specs/ if keep_artifacts is set, which is useful for debugging.
+
+    With incremental set, the merged copy of each input spec is saved next to the master file, along with a manifest of
+    the hashes of the input spec and every file it references. On the next run, input specs whose files are all
+    unchanged are loaded from the saved copy instead of being merged again.
+    """
+    MANIFEST_VERSION = 1
+
+    def __init__(self, files_to_merge, master, document_cache=None, jobs=1, keep_artifacts=False, compact=False,
+                 incremental=False):
         self.oapi_file = master
+        self.document_cache = document_cache if document_cache is not None else DocumentCache()
+        self.jobs = jobs
+        self.compact = compact
+        self.keep_artifacts = keep_artifacts
+        self.incremental = incremental
         self.main_oapi = self._deserialize_file()
-        self.oapis = []
         self.tmp_dir = "tmp_merged_specs"
+        self.manifest_file = self.oapi_file + ".manifest.json"
+        self.fragments_dir = self.oapi_file + ".fragments"
 
-        shutil.rmtree(self.tmp_dir, onerror=abc)
-        os.makedirs(self.tmp_dir)
-        for i, f in enumerate(files_to_merge):
-            f_path = os.path.expanduser(f)
-            merger = Merger(f_path, self.tmp_dir + "/" + str(i) + ".yaml")
-            merger.merge()
-            self.oapis.append(merger.oapi_obj)
+        files = [os.path.realpath(os.path.expanduser(f)) for f in files_to_merge]
+        self.oapis = [None] * len(files)
+        self.dependencies = [None] * len(files)
+        manifest = self._read_manifest() if self.incremental else dict()
 
-    def merge(self):
+        for i, f_path in enumerate(files):
+            fragment = self._read_fragment(manifest.get(f_path))
+            if fragment is not None:
+                self.oapis[i] = fragment
+                self.dependencies[i] = manifest[f_path]["hashes"]
+
+        # input specs that need to be merged, because they or one of the files they reference changed.
+        stale = [i for i, oapi in enumerate(self.oapis) if oapi is None]
+        self.stale_files = [files[i] for i in stale]
+        output_files = [None] * len(stale)
+
+        if self.keep_artifacts:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            os.makedirs(self.tmp_dir)
+            output_files = [self.tmp_dir + "/" + str(i) + ".yaml" for i in stale]
+
+        if self.jobs > 1 and len(self.stale_files) > 1:
+            # each worker merges a whole spec, so the workers themselves parse referenced files serially.
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                results = list(executor.map(_merge_spec_file,
+                                            [(f, o, 1) for f, o in zip(self.stale_files, output_files)]))
+        else:
+            results = []
+            for f_path, output_file in zip(self.stale_files, output_files):
+                merger = Merger(f_path, output_file, document_cache=self.document_cache, jobs=self.jobs)
+                merger.merge()
+                results.append((merger.oapi_obj, merger.referenced_files()))
+
+        for i, (oapi, referenced_files) in zip(stale, results):
+            self.oapis[i] = oapi
+            self.dependencies[i] = dict((dep, utils.hash_file(dep)) for dep in [files[i]] + referenced_files)
+
+        if self.keep_artifacts:
+            # tmp_merged_specs/ was cleared above, so the input specs loaded from their saved copy are written as well
+            for i, oapi in enumerate(self.oapis):
+                if i not in stale:
+                    utils.serialize_to_file(oapi, self.tmp_dir + "/" + str(i) + ".yaml")
+
+        if self.incremental:
+            # fragments are saved now, because merge() strips the extensions from the same objects in place.
+            self._write_manifest(files, stale)
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+        if manifest.get("version") != self.MANIFEST_VERSION:
+            return dict()
+        return manifest.get("files", dict())
+
+    def _read_fragment(self, entry):
+        """
+        Loads the saved merged copy of an input spec, if none of the files it was merged from have changed.
+        :param entry: manifest entry of the input spec
+        :return: dictionary representation of the merged spec, or None if it has to be merged again
+        """
+        if not entry:
+            return None
+
+        for dep, digest in entry["hashes"].items():
+            try:
+                if utils.hash_file(dep) != digest:
+                    return None
+            except OSError:
+                return None
+
+        try:
+            with open(os.path.join(self.fragments_dir, entry["fragment"]), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def _write_manifest(self, files, stale):
+        os.makedirs(self.fragments_dir, exist_ok=True)
+        manifest_files = dict()
+        stale = set(stale)
+
+        for i, f_path in enumerate(files):
+            fragment = hashlib.sha256(f_path.encode("utf-8")).hexdigest() + ".pickle"
+            if i in stale:
+                with open(os.path.join(self.fragments_dir, fragment), "wb") as f:
+                    pickle.dump(self.oapis[i], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            manifest_files[f_path] = {
+                "fragment": fragment,
+                "hashes": self.dependencies[i]
+            }
+
+        with open(self.manifest_file, "w") as f:
+            json.dump({"version": self.MANIFEST_VERSION, "files": manifest_files}, f, indent=3)
+
+    def merge(self, remove_keys=None):
+        """
+        Merges the paths and components of all input specs into the master spec, strips the mechanic extensions from
+        the result and writes it to the master file.
+        :param remove_keys: extension keys to strip, defaults to MECHANIC_EXTENSIONS
+        """
         self.main_oapi["paths"] = dict()
         self.main_oapi["components"] = dict()
         self.main_oapi["components"]["schemas"] = dict()
@@ -185,51 +412,41 @@ class SpecMerger:
             for name, val in obj["components"]["headers"].items():
                 self.main_oapi["components"]["headers"][name] = val
 
-        REMOVE_KEYS = ['x-mechanic-controller', 'x-mechanic-tags', 'x-mechanic-db', 'x-mechanic-schema',
-                       'x-mechanic-public', 'x-mechanic-embeddable', 'x-mechanic-model']
-        self._clean_schema_properties()
-        for rkey in REMOVE_KEYS:
-            self._clean(self.main_oapi, key=rkey)
+        self._strip_extensions(MECHANIC_EXTENSIONS if remove_keys is None else remove_keys)
         self._write_to_file()
-        shutil.rmtree(self.tmp_dir)
-
-    def _clean(self, obj, key=None):
-        if key:
-            if isinstance(obj, list):
-                for item in obj:
-                    self._clean(item, key=key)
-            elif isinstance(obj, dict):
-                if obj.get(key):
-                    obj.pop(key)
-                for k, v in obj.items():
-                    self._clean(v, key=key)
 
-    def _clean_schema_properties(self):
+    def _strip_extensions(self, remove_keys):
         """
-        Removes properties that have x-mechanic-db.model_only = true
+        Removes the given extension keys everywhere in the merged spec, and removes properties that have
+        x-mechanic-db.model_only = true, in a single traversal of the spec.
+        :param remove_keys: keys to remove
         """
-        iter_dict = copy.deepcopy(self.main_oapi)
+        remove_keys = set(remove_keys)
+        # properties of these dictionaries are checked for model_only before any extension is removed from them.
+        schema_properties = set(id(schema["properties"])
+                                for schema in self.main_oapi["components"]["schemas"].values()
+                                if isinstance(schema.get("properties"), dict))
+        stack = [self.main_oapi]
 
-        for schema_name, schema in iter_dict['components']['schemas'].items():
-            for prop_name, prop in schema.get('properties', {}).items():
-                if prop.get('x-mechanic-db', {}).get('model_only'):
-                    self.main_oapi['components']['schemas'][schema_name]['properties'].pop(prop_name)
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, dict):
+                if id(obj) in schema_properties:
+                    for prop_name in [name for name, prop in obj.items()
+                                      if prop.get("x-mechanic-db", {}).get("model_only")]:
+                        obj.pop(prop_name)
+
+                for key in [key for key in remove_keys if obj.get(key)]:
+                    obj.pop(key)
+                stack.extend(obj.values())
+            elif isinstance(obj, list):
+                stack.extend(obj)
 
     def _write_to_file(self):
         """
         Write the merged data into the specified output file.
         """
-        with open(self.oapi_file, "w") as f:
-            if self.oapi_file.endswith(".json"):
-                json_data = json.dumps(self.main_oapi, indent=3)
-                f.write(json_data)
-            elif self.oapi_file.endswith(".yaml") or self.oapi_file.endswith(".yml"):
-                yaml_data = yaml.dump(OrderedDict(self.main_oapi),
-                                      Dumper=yamlordereddictloader.Dumper,
-                                      default_flow_style=False)
-                f.write(yaml_data)
-            else:
-                raise SyntaxError("Specified output file is not of correct format. Must be either json or yaml.")
+        utils.serialize_to_file(self.main_oapi, self.oapi_file, compact=self.compact)
 
     def _deserialize_file(self):
         """
@@ -237,14 +454,6 @@ class SpecMerger:
         :param oapi_file:
         :return: dictionary representation of the OpenAPI file
         """
-        if self.oapi_file.endswith(".json"):
-            with open(self.oapi_file) as f:
-                oapi = json.load(f)
-        elif self.oapi_file.endswith(".yaml") or self.oapi_file.endswith(".yml"):
-            with open(self.oapi_file) as f:
-                oapi = yaml.load(f)
-        else:
-            raise SyntaxError("File is not of correct format. Must be either json or yaml (and filename extension must "
-                              "one of those too).")
+        oapi = utils.deserialize_file(self.oapi_file)
         self.root_dir = os.path.dirname(os.path.realpath(self.oapi_file))
         return oapi
\ No newline at end of file
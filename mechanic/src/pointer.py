@@ -0,0 +1,85 @@
+def escape(token):
+    """
+    Escapes a key for use in a JSON pointer, e.g. '/pets/{id}' becomes '~1pets~1{id}'.
+    """
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def unescape(token):
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+class PointerIndex(object):
+    """
+    Maps every JSON pointer in a document to the node it points at, so that local references of any depth, such as
+    #/components/schemas/Pet or #/components/schemas/Pet/properties/name, resolve with a single dictionary lookup.
+
+    The index is built once. Nodes that are added to the document afterwards are not indexed, but nodes that are
+    modified in place still resolve to the modified object.
+    """
+    def __init__(self, document):
+        self.document = document
+        self._nodes = dict()
+        self._build()
+
+    def __getstate__(self):
+        # the index is several times the size of the document, so it is built again instead of pickled, e.g. when the
+        # index is sent to worker processes.
+        return {"document": self.document}
+
+    def __setstate__(self, state):
+        self.document = state["document"]
+        self._nodes = dict()
+        self._build()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __contains__(self, ref):
+        return self._to_pointer(ref) in self._nodes
+
+    def _build(self):
+        stack = [("", self.document)]
+
+        while stack:
+            pointer, node = stack.pop()
+            self._nodes[pointer] = node
+
+            if isinstance(node, dict):
+                for key, value in node.items():
+                    stack.append((pointer + "/" + escape(str(key)), value))
+            elif isinstance(node, list):
+                for i, value in enumerate(node):
+                    stack.append((pointer + "/" + str(i), value))
+
+    def resolve(self, ref):
+        """
+        Gets a referenced object.
+        :param ref: local reference link, example: #/components/schemas/Pet
+        :return: the referenced object
+        """
+        pointer = self._to_pointer(ref)
+        try:
+            return self._nodes[pointer]
+        except KeyError:
+            raise SyntaxError(self._describe_dangling(ref, pointer))
+
+    def _to_pointer(self, ref):
+        if not ref.startswith("#"):
+            raise SyntaxError("Only references within the same document can be resolved, found: %s" % ref)
+        return ref[1:]
+
+    def _describe_dangling(self, ref, pointer):
+        """
+        Builds an error message that names the deepest part of a dangling reference that does exist.
+        """
+        tokens = pointer.split("/")
+        for i in range(len(tokens) - 1, 0, -1):
+            parent = "/".join(tokens[:i])
+            if parent in self._nodes:
+                return "Reference '%s' could not be resolved: '#%s' has no item '%s'." % (
+                    ref, parent, unescape(tokens[i]))
+        return "Reference '%s' could not be resolved." % ref
@@ -0,0 +1,102 @@
+import sys
+import json
+import time
+import datetime
+import contextlib
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory is not reported there.
+    resource = None
+
+DEFAULT_TOP_SCHEMAS = 10
+
+
+def profile_stage(profiler, name):
+    """
+    Context manager that times a build stage with profiler, or does nothing if profiler is None.
+    """
+    return profiler.stage(name) if profiler is not None else _no_stage()
+
+
+@contextlib.contextmanager
+def _no_stage():
+    yield
+
+
+class Profiler(object):
+    """
+    Collects the wall and CPU time of each build stage, counts of what was built and the slowest schemas to compile, for
+    'mechanic build --profile'. A stage that is entered more than once adds up, e.g. a compiler pass that runs once per
+    worker process. The report lists the top_schemas slowest schemas, or every schema if top_schemas is 0.
+    """
+    def __init__(self, top_schemas=DEFAULT_TOP_SCHEMAS):
+        self.top_schemas = top_schemas
+        self.info = OrderedDict()
+        self.stages = OrderedDict()
+        self.counts = OrderedDict()
+        self.schema_times = dict()
+        self._started_at = datetime.datetime.utcnow()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start_wall, time.process_time() - start_cpu)
+
+    def add_stage(self, name, wall, cpu, calls=1):
+        if name not in self.stages:
+            self.stages[name] = {"wall": 0.0, "cpu": 0.0, "calls": 0}
+        self.stages[name]["wall"] += wall
+        self.stages[name]["cpu"] += cpu
+        self.stages[name]["calls"] += calls
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def add_schema_time(self, schema_name, wall):
+        self.schema_times[schema_name] = self.schema_times.get(schema_name, 0.0) + wall
+
+    def merge(self, other):
+        """
+        Adds the stages, counts and schema times collected by another profiler, e.g. in a worker process.
+        """
+        for name, stage in other.stages.items():
+            self.add_stage(name, stage["wall"], stage["cpu"], calls=stage["calls"])
+        for name, value in other.counts.items():
+            self.count(name, value)
+        for schema_name, wall in other.schema_times.items():
+            self.add_schema_time(schema_name, wall)
+
+    def report(self):
+        """
+        :return: dictionary with the profile of the build so far
+        """
+        slowest = sorted(self.schema_times.items(), key=lambda item: item[1], reverse=True)[:self.top_schemas or None]
+
+        report = OrderedDict(self.info)
+        report["started_at"] = self._started_at.isoformat() + "Z"
+        report["wall"] = time.perf_counter() - self._start_wall
+        report["cpu"] = time.process_time() - self._start_cpu
+        report["peak_memory_bytes"] = self._get_peak_memory(resource.RUSAGE_SELF) if resource else None
+        report["peak_worker_memory_bytes"] = self._get_peak_memory(resource.RUSAGE_CHILDREN) if resource else None
+        report["stages"] = self.stages
+        report["counts"] = self.counts
+        report["slowest_schemas"] = [{"schema": schema_name, "wall": wall} for schema_name, wall in slowest]
+        return report
+
+    def write(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.report(), f, indent=3)
+
+    def _get_peak_memory(self, who):
+        peak = resource.getrusage(who).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
@@ -1,8 +1,7 @@
 import os
 import copy
-import json
 
-import yaml
+import mechanic.src.utils as utils
 
 OPENAPI3_FILE_KEY = "OPENAPI"
 APP_NAME_KEY = "APP_NAME"
@@ -75,14 +74,19 @@ def read_mechanicfile(file_path):
     path = os.path.expanduser(file_path)
     custom_options = dict()
 
-    with open(path, "r") as f:
-        if file_path.endswith(".json"):
-            custom_options = json.load(f)
-        elif file_path.endswith(".yaml") or file_path.endswith(".yml"):
-            custom_options = yaml.load(f)
-        else:
-            raise SyntaxError("mechanic file is not of correct format. Must either be json or yaml")
+    if file_path.endswith(".json") or file_path.endswith(".yaml") or file_path.endswith(".yml"):
+        custom_options = utils.deserialize_file(path)
+    else:
+        raise SyntaxError("mechanic file is not of correct format. Must either be json or yaml")
 
+    return get_options(custom_options)
+
+
+def get_options(custom_options):
+    """
+    :param custom_options: dictionary of mechanic file options
+    :return: the options, with the defaults filled in for options that are not set
+    """
     options = copy.deepcopy(default_options)
     for key, val in custom_options.items():
         options[key] = val
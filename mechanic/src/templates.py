@@ -0,0 +1,70 @@
+"""
+Renders the jinja templates that generated code is built from. One jinja environment is shared by every render in a
+process, so each template is read and compiled once per process. Compiled templates are also cached on disk under the
+parse cache directory (see utils.get_parse_cache_dir), so that later builds do not compile them at all.
+"""
+import os
+
+import jinja2
+
+import mechanic.src.utils as utils
+
+_environment = None
+
+
+class PathLoader(jinja2.BaseLoader):
+    """
+    Loads a template by its file path, so that templates from any folder can share one environment.
+    """
+    def get_source(self, environment, template):
+        try:
+            with open(template, "rb") as f:
+                source = f.read().decode("utf-8")
+        except FileNotFoundError:
+            raise jinja2.TemplateNotFound(template)
+
+        mtime = os.path.getmtime(template)
+
+        def uptodate():
+            try:
+                return os.path.getmtime(template) == mtime
+            except OSError:
+                return False
+
+        return source, template, uptodate
+
+
+class BytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    Same as jinja2.FileSystemBytecodeCache, but creates the cache directory, and like the parse cache, a cache that can
+    not be written does not fail the build.
+    """
+    def dump_bytecode(self, bucket):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            super(BytecodeCache, self).dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+def get_environment():
+    """
+    :return: the jinja environment of this process
+    """
+    global _environment
+
+    if _environment is None:
+        cache_dir = utils.get_parse_cache_dir()
+        bytecode_cache = BytecodeCache(os.path.join(cache_dir, "templates")) if cache_dir else None
+        _environment = jinja2.Environment(loader=PathLoader(), bytecode_cache=bytecode_cache)
+    return _environment
+
+
+def render(tpl_path, context):
+    """
+    Renders a template file.
+    :param tpl_path: path of the template
+    :param context: dictionary of template variables
+    :return: the rendered template
+    """
+    return get_environment().get_template(os.path.abspath(tpl_path)).render(context)
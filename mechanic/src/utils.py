@@ -1,28 +1,267 @@
-import json
+import io
+import os
 import re
+import json
+import hashlib
+import pickle
+from collections import OrderedDict
 
 import yaml
-import jinja2
 
 SUPPORTED_VARS = ["version", "namespace"]
 
+# Use the LibYAML bindings when PyYAML was built with them, they parse several times faster than the pure python loader.
+YAML_LOADER = yaml.CLoader if yaml.__with_libyaml__ else yaml.Loader
+YAML_DUMPER = yaml.CDumper if yaml.__with_libyaml__ else yaml.Dumper
+
+PARSE_CACHE_VERSION = "1"
+# once the entries of the parse cache take more than this many bytes, the least recently used ones are removed.
+PARSE_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+TEMPLATE_VAR_REGEX = re.compile(r"{{\s*([A-Za-z_]\w*)\s*}}")
+_compiled_templates = dict()
+# size of the entries of each parse cache directory as far as this process knows.
+_parse_cache_sizes = dict()
+
+
 def deserialize_file(file_path):
     """
-    Deserializes a file from either json or yaml and converts it to a dictionary structure to operate on.
+    Deserializes a file from either json or yaml and converts it to a dictionary structure to operate on. If the file
+    contents were parsed before, the result is loaded from the on-disk parse cache instead.
     :param oapi_file:
     :return: dictionary representation of the OpenAPI file
     """
-    if file_path.endswith(".json"):
-        with open(file_path) as f:
-            mechanic_obj = json.load(f)
-    elif file_path.endswith(".yaml") or file_path.endswith(".yml"):
-        with open(file_path) as f:
-            mechanic_obj = yaml.load(f)
-    else:
+    if not (file_path.endswith(".json") or file_path.endswith(".yaml") or file_path.endswith(".yml")):
         raise SyntaxError("File is not of correct format. Must be either json or yaml (and filename extension must "
                           "be one of those too).")
+
+    with open(file_path, "rb") as f:
+        contents = f.read()
+
+    cache_file = _get_parse_cache_file(file_path, contents)
+    mechanic_obj = _read_parse_cache(cache_file)
+
+    if mechanic_obj is None:
+        if file_path.endswith(".json"):
+            mechanic_obj = json.loads(contents.decode("utf-8"))
+        else:
+            mechanic_obj = yaml.load(contents, Loader=YAML_LOADER)
+        _write_parse_cache(cache_file, mechanic_obj)
     return mechanic_obj
 
 
+def hash_file(file_path):
+    """
+    :return: sha256 hex digest of the contents of a file
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def serialize_to_file(obj, file_path, compact=False):
+    """
+    Serializes a dictionary structure to either a json or yaml file. The document is streamed to the file as it is
+    encoded, instead of being built up as one string first.
+    :param obj: dictionary to serialize
+    :param file_path: output file, the extension determines the format
+    :param compact: write json without indentation or whitespace between items
+    """
+    _check_serialization_format(file_path)
+    with open(file_path, "w") as f:
+        _serialize(obj, f, file_path, compact=compact)
+
+
+def serialize_to_string(obj, file_path, compact=False):
+    """
+    Same as serialize_to_file, but returns the contents that would be written to file_path instead of writing them.
+    """
+    _check_serialization_format(file_path)
+    stream = io.StringIO()
+    _serialize(obj, stream, file_path, compact=compact)
+    return stream.getvalue()
+
+
+def _check_serialization_format(file_path):
+    if not (file_path.endswith(".json") or file_path.endswith(".yaml") or file_path.endswith(".yml")):
+        raise SyntaxError("Specified output file is not of correct format. Must be either json or yaml.")
+
+
+def _serialize(obj, stream, file_path, compact=False):
+    if file_path.endswith(".json"):
+        if compact:
+            json.dump(obj, stream, separators=(",", ":"))
+        else:
+            json.dump(obj, stream, indent=3)
+    else:
+        yaml.dump(OrderedDict(obj), stream, Dumper=OrderedDumper, default_flow_style=False)
+
+
+class OrderedDumper(YAML_DUMPER):
+    """
+    Same as yamlordereddictloader.Dumper, i.e. OrderedDicts are dumped as regular maps in insertion order, but uses the
+    LibYAML emitter when it is available.
+    """
+    def represent_ordereddict(self, data):
+        return self.represent_mapping("tag:yaml.org,2002:map", data.items())
+
+
+OrderedDumper.add_representer(OrderedDict, OrderedDumper.represent_ordereddict)
+
+
+def get_parse_cache_dir():
+    """
+    Parsed documents are cached on disk, keyed by a hash of the file contents. The directory is read from the
+    MECHANIC_CACHE_DIR environment variable each time, an empty string disables the cache. Cache entries are unpickled,
+    so the default is a directory of the user, not one in the project that a checkout could ship with crafted entries.
+    :return: directory of the parse cache, or an empty string if the cache is disabled
+    """
+    default = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "mechanic")
+    return os.environ.get("MECHANIC_CACHE_DIR", default)
+
+
+def _get_parse_cache_file(file_path, contents):
+    cache_dir = get_parse_cache_dir()
+    if not cache_dir:
+        return None
+
+    digest = hashlib.sha256()
+    digest.update(PARSE_CACHE_VERSION.encode("utf-8"))
+    digest.update(os.path.splitext(file_path)[1].encode("utf-8"))
+    digest.update(contents)
+    return os.path.join(cache_dir, digest.hexdigest() + ".pickle")
+
+
+def _read_parse_cache(cache_file):
+    if not cache_file:
+        return None
+
+    try:
+        with open(cache_file, "rb") as f:
+            obj = pickle.load(f)
+    except Exception:
+        # missing or unreadable entries are treated as a cache miss
+        return None
+
+    try:
+        # the modification time of an entry is when it was last used, see _prune_parse_cache
+        os.utime(cache_file)
+    except OSError:
+        pass
+    return obj
+
+
+def _write_parse_cache(cache_file, obj):
+    if not cache_file:
+        return
+
+    # write to a temporary file first so that concurrent builds never see a partially written entry
+    tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(tmp_file, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        # the cache is only an optimization, so a read-only or full disk should not fail the build
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        return
+
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir not in _parse_cache_sizes:
+        _parse_cache_sizes[cache_dir] = sum(entry_size for _, entry_size, _ in _list_parse_cache(cache_dir))
+    else:
+        _parse_cache_sizes[cache_dir] += size
+
+    if _parse_cache_sizes[cache_dir] > PARSE_CACHE_MAX_SIZE:
+        _prune_parse_cache(cache_dir, keep=cache_file)
+
+
+def _list_parse_cache(cache_dir):
+    """
+    :return: list of (path, size, modification time) of the entries in a parse cache directory
+    """
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".pickle"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    except OSError:
+        pass
+    return entries
+
+
+def _prune_parse_cache(cache_dir, keep=None):
+    """
+    Removes the least recently used entries of a parse cache directory, until they take at most 3/4 of
+    PARSE_CACHE_MAX_SIZE.
+    :param keep: path of an entry that is not removed, e.g. the one that was just written
+    """
+    entries = sorted(_list_parse_cache(cache_dir), key=lambda entry: entry[2])
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for path, entry_size, _ in entries:
+        if size <= PARSE_CACHE_MAX_SIZE * 3 // 4:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            size -= entry_size
+        except OSError:
+            # another process may have removed it already
+            pass
+    _parse_cache_sizes[cache_dir] = size
+
+
 def replace_template_var(s, **kwargs):
-    return jinja2.Template(s).render(**kwargs)
+    """
+    Renders a pattern such as "{{resource}}Schema" or "models/{{namespace}}.py". Each pattern is only compiled once, and
+    patterns that do nothing but substitute plain variables are rendered without jinja.
+    """
+    render = _compiled_templates.get(s)
+    if render is None:
+        render = _compile_template(s)
+        _compiled_templates[s] = render
+    return render(kwargs)
+
+
+def _compile_template(s):
+    """
+    Compiles a pattern into a function that takes a dictionary of variables and returns the rendered pattern. The
+    result is the same as rendering the pattern with jinja2.Template.
+    """
+    import jinja2
+
+    parts = TEMPLATE_VAR_REGEX.split(s)
+    literals = parts[0::2]
+    var_names = parts[1::2]
+
+    is_simple = not any(token in literal for literal in literals for token in ["{{", "}}", "{%", "{#", "\n", "\r"]) \
+        and not any(var_name.lower() in ["true", "false", "none"] for var_name in var_names)
+
+    if not is_simple:
+        template = jinja2.Template(s)
+        return lambda variables: template.render(**variables)
+
+    jinja_globals = jinja2.defaults.DEFAULT_NAMESPACE
+
+    def render(variables):
+        # like in jinja, missing variables fall back to the jinja globals, and otherwise render as an empty string
+        result = [literals[0]]
+        for var_name, literal in zip(var_names, literals[1:]):
+            result.append(str(variables.get(var_name, jinja_globals.get(var_name, ""))))
+            result.append(literal)
+        return "".join(result)
+
+    return render
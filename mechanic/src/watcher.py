@@ -0,0 +1,115 @@
+import os
+import time
+from collections import OrderedDict
+
+from mechanic.src.cache import DocumentCache
+from mechanic.src.compiler import Compiler
+from mechanic.src.generator import Generator
+from mechanic.src.reader import read_mechanicfile
+
+DEFAULT_INTERVAL = 0.5
+
+
+class Watcher(object):
+    """
+    Builds an app like 'mechanic build', then builds it again whenever the mechanic file, the spec or one of the files
+    the spec references changes. Files are watched by polling their modification times.
+
+    Everything that can be reused stays in memory between builds: parsed external files are kept in a DocumentCache,
+    compiled templates in the jinja environment of the process, and the compiler runs incrementally with its state kept
+    in memory, so only the schemas that changed are compiled again. The generator only writes files that changed.
+    """
+    def __init__(self, directory, mechanic_file_path, jobs=1, interval=DEFAULT_INTERVAL):
+        self.directory = directory
+        self.mechanic_file_path = mechanic_file_path
+        self.jobs = jobs
+        self.interval = interval
+        self.document_cache = DocumentCache()
+        self.incremental_state = dict()
+        # path of each watched file to its modification time, or None if it does not exist
+        self.watched_files = OrderedDict()
+
+    def run(self, report=print):
+        """
+        Builds the app, then keeps building it again after every change until interrupted.
+        :param report: function that is called with a line describing each build
+        """
+        report(self.format_result(self.build()))
+        while True:
+            time.sleep(self.interval)
+            result = self.poll()
+            if result:
+                report(self.format_result(result))
+
+    def poll(self):
+        """
+        Builds the app again if a watched file changed.
+        :return: the result of the build (see build), or None if nothing changed
+        """
+        changed_files = [path for path, mtime in self.watched_files.items() if self._get_mtime(path) != mtime]
+        if changed_files:
+            return self.build(changed_files)
+        return None
+
+    def build(self, changed_files=None):
+        """
+        Builds the app. A build that fails, e.g. because a file was saved half way through an edit, is reported and the
+        files are watched for the next change.
+        :param changed_files: watched files that changed since the last build
+        :return: dictionary with the changed files, the time the build took in seconds, and either the error, or the
+        names of the schemas that were compiled and the number of files that were written and that did not change
+        """
+        start = time.perf_counter()
+        result = OrderedDict()
+        result["changed_files"] = changed_files or []
+        files = [self.mechanic_file_path] + list(self.watched_files.keys())
+        # modification times are taken before the build, so that changes made while building cause another build.
+        mtimes = dict((path, self._get_mtime(path)) for path in files)
+
+        try:
+            options = read_mechanicfile(self.mechanic_file_path)
+            compiler = Compiler(options,
+                                mechanic_file_path=self.mechanic_file_path,
+                                document_cache=self.document_cache,
+                                incremental=True,
+                                jobs=self.jobs,
+                                incremental_state=self.incremental_state)
+            files = [self.mechanic_file_path, compiler.oapi_file] + compiler.merger.referenced_files()
+            compiler.compile()
+
+            generator = Generator(self.directory,
+                                  compiler.mech_obj,
+                                  options=options,
+                                  oapi_obj=compiler.oapi_obj,
+                                  jobs=self.jobs)
+            generator.generate()
+
+            result["stale_schemas"] = compiler.stale_schemas
+            result["written_files"] = generator.count_written_files()
+            result["unchanged_files"] = len(generator.file_changes) - result["written_files"]
+        except Exception as e:
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+
+        self.watched_files = OrderedDict((path, mtimes[path] if path in mtimes else self._get_mtime(path))
+                                         for path in files if path)
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    def format_result(self, result):
+        """
+        :return: line describing the result of a build
+        """
+        build = "build"
+        if result["changed_files"]:
+            build = ", ".join(os.path.relpath(path) for path in result["changed_files"]) + " changed, rebuild"
+
+        if result.get("error"):
+            return "%s failed after %.3fs: %s" % (build, result["seconds"], result["error"])
+        return "%s took %.3fs: %d schemas compiled, %d files written, %d unchanged" % (
+            build, result["seconds"], len(result["stale_schemas"]), result["written_files"], result["unchanged_files"])
+
+    def _get_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def parse_cache_dir(tmp_path_factory):
+    """
+    Points the parse cache at a temporary directory, so that the tests, and the mechanic processes they start, do not
+    read or write the cache in the user's home directory.
+    """
+    original = os.environ.get("MECHANIC_CACHE_DIR")
+    cache_dir = str(tmp_path_factory.mktemp("mechanic-cache"))
+    os.environ["MECHANIC_CACHE_DIR"] = cache_dir
+    yield cache_dir
+    if original is None:
+        del os.environ["MECHANIC_CACHE_DIR"]
+    else:
+        os.environ["MECHANIC_CACHE_DIR"] = original
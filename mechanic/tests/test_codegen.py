@@ -0,0 +1,64 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mechanic.src.codegen import CodeGenerator, read_jobs_file, MECHANIC_SAVE_MARKER
+from mechanic.src.generator import GENERATED_AT_REGEX
+
+
+class TestCodeGenerator(TestCase):
+    SHOP = os.path.dirname(__file__) + "/specs/shop.yaml"
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _read(self, path):
+        with open(path) as f:
+            return GENERATED_AT_REGEX.sub("", f.read())
+
+    def test_generate_jobs_with_one_merge(self):
+        jobs_file = self.work_dir + "/jobs.json"
+        with open(jobs_file, "w") as f:
+            json.dump([
+                {"type": "schema", "output_file": self.work_dir + "/schemas.py"},
+                {"type": "controller", "output_file": self.work_dir + "/controllers.py"},
+                {"type": "schema", "output_file": self.work_dir + "/schemas-again.py", "filter_tags": []},
+            ], f)
+        jobs = read_jobs_file(jobs_file, filter_tags=["unused"])
+        self.assertEqual(jobs[0]["filter_tags"], ["unused"])
+        jobs[0]["filter_tags"] = []
+
+        CodeGenerator(self.SHOP).generate(jobs)
+
+        # allOf schemas are only flattened once, so the second schema file is the same as the first
+        self.assertEqual(self._read(self.work_dir + "/schemas.py"), self._read(self.work_dir + "/schemas-again.py"))
+        for job in jobs:
+            single_file = self.work_dir + "/single.py"
+            CodeGenerator(self.SHOP).generate([dict(job, output_file=single_file)])
+            self.assertEqual(self._read(job["output_file"]), self._read(single_file))
+            os.remove(single_file)
+
+    def test_generate_keeps_save_block(self):
+        output_file = self.work_dir + "/schemas.py"
+        with open(output_file, "w") as f:
+            f.write("# my imports\n" + MECHANIC_SAVE_MARKER + "\nold code\n")
+
+        CodeGenerator(self.SHOP).generate([{"type": "schema", "output_file": output_file}])
+
+        contents = self._read(output_file)
+        self.assertTrue(contents.startswith("# my imports\n" + MECHANIC_SAVE_MARKER))
+        self.assertFalse("old code" in contents)
+        self.assertTrue("class ItemSchema" in contents)
+
+    def test_read_jobs_file_invalid(self):
+        jobs_file = self.work_dir + "/jobs.json"
+        with open(jobs_file, "w") as f:
+            json.dump([{"type": "view", "output_file": "views.py"}], f)
+
+        with self.assertRaises(SyntaxError):
+            read_jobs_file(jobs_file)
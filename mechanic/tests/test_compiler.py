@@ -1,7 +1,12 @@
 import os
-from unittest import TestCase
+import pickle
+from unittest import TestCase, mock
 
+import mechanic.src.compiler as compiler_module
 from mechanic.src.compiler import Compiler
+from mechanic.src.merger import Merger
+from mechanic.src.pointer import PointerIndex
+from mechanic.src.profiler import Profiler
 from mechanic.src.reader import read_mechanicfile
 from mechanic.src.utils import deserialize_file
 
@@ -18,11 +23,12 @@ class TestCompiler(TestCase):
         pass
 
     def tearDown(self):
-        try:
-            os.remove(self.GROCERY_TMP)
-            os.remove(self.PETSTORE_TMP)
-        except Exception:
-            pass
+        for tmp in [self.GROCERY_TMP, self.PETSTORE_TMP, self.GROCERY_TMP + ".manifest.json",
+                    self.GROCERY_TMP + ".fragments.pickle"]:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
 
     def test_compile(self):
         options = read_mechanicfile(self.MECHANIC_BUILD_FILE_PETSTORE)
@@ -111,6 +117,133 @@ class TestCompiler(TestCase):
         self.assertEqual(obj["controllers"]["ShopperItemController"]["base_controller_name"], "MechanicBaseItemController")
         self.assertEqual(obj["controllers"]["ShopperItemController"]["base_controller_path"], "mechanic.base.controllers")
 
+    def test_compile_malformed_overrides(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        options["OVERRIDE_BASE_MODEL"] = [{"with": "mypackage.MyModel"}]
+        options["OVERRIDE_TABLE_NAMES"] = [{"for": ["models.default.Groceries"], "with": "groceries"}]
+
+        with self.assertRaises(SyntaxError) as e, mock.patch.object(Merger, "merge") as merge:
+            Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, output=self.GROCERY_TMP)
+        self.assertTrue("'for' attribute is required in the 'OVERRIDE_BASE_MODEL'" in str(e.exception))
+        self.assertTrue("'OVERRIDE_TABLE_NAMES' is not formatted properly" in str(e.exception))
+        # the options are checked before the spec is merged
+        merge.assert_not_called()
+
+    def test_compile_incremental(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, output=self.GROCERY_TMP).compile()
+        full = deserialize_file(self.GROCERY_TMP)
+
+        def compile_incremental(change=None):
+            compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, output=self.GROCERY_TMP,
+                                incremental=True)
+            if change:
+                change(compiler.oapi_obj["components"]["schemas"])
+                # the spec changed after it was merged, so references have to be indexed again
+                compiler.pointer_index = PointerIndex(compiler.oapi_obj)
+            compiler.compile()
+            return compiler.stale_schemas, deserialize_file(self.GROCERY_TMP)
+
+        stale, obj = compile_incremental()
+        self.assertEqual(len(stale), len(full["resources"]))
+        self.assertEqual(obj, full)
+
+        stale, obj = compile_incremental()
+        self.assertEqual(stale, [])
+        self.assertEqual(obj, full)
+
+        # Shopper references Wallet, so it is built again as well
+        def add_column(schemas):
+            schemas["Wallet"]["properties"]["currency"] = {"type": "string"}
+        stale, obj = compile_incremental(add_column)
+        self.assertEqual(stale, ["Wallet", "Shopper"])
+        self.assertTrue("currency" in obj["models"]["Wallet"]["columns"])
+        self.assertEqual(obj["models"]["Shopper"], full["models"]["Shopper"])
+
+        # Child references a property of Base, so it depends on Base
+        def add_child(*properties):
+            def change(schemas):
+                schemas["Base"] = {"type": "object", "properties": {"inner": {
+                    "type": "object", "properties": dict((name, {"type": "string"}) for name in properties)}}}
+                schemas["Child"] = {"allOf": [{"$ref": "#/components/schemas/Base/properties/inner"}]}
+            return change
+        compile_incremental(add_child("a"))
+        stale, obj = compile_incremental(add_child("a", "b"))
+        self.assertEqual(stale, ["Base", "Child"])
+        self.assertEqual(sorted(obj["models"]["Child"]["columns"]), ["a", "b"])
+
+    def test_compile_parallel_matches_serial(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, output=self.GROCERY_TMP).compile()
+        with open(self.GROCERY_TMP) as f:
+            serial = f.read()
+
+        # the plurals for table names are computed before the worker processes start, so they do not import inflect
+        compiler_module._plural_nouns.clear()
+        compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, output=self.GROCERY_TMP,
+                            jobs=2)
+        compiler.compile()
+        with open(self.GROCERY_TMP) as f:
+            self.assertEqual(f.read(), serial)
+        for record in compiler.schema_records:
+            self.assertTrue(compiler._get_tablename_noun(record.model_name) in compiler_module._plural_nouns)
+
+        # worker processes that are spawned instead of forked get a pickled copy of the worker compiler
+        compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY)
+        compiler.normalize()
+        worker = pickle.loads(pickle.dumps(compiler._get_worker_compiler()))
+        self.assertEqual(worker.merger, None)
+        self.assertEqual(worker._build_fragments(compiler.schema_records),
+                         compiler._build_fragments(compiler.schema_records))
+
+    def test_compile_profile(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        serial = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY).compile()
+
+        profiler = Profiler(top_schemas=3)
+        compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, profiler=profiler)
+        self.assertEqual(compiler.compile(), serial)
+
+        report = profiler.report()
+        self.assertEqual(report["stages"]["compile.build_models_pass1"]["calls"], 1)
+        self.assertEqual(report["stages"]["compile.build_controllers_pass1"]["calls"], 1)
+        self.assertTrue(report["stages"]["merge"]["wall"] > 0)
+        self.assertEqual(report["counts"]["schemas"], 15)
+        self.assertEqual(report["counts"]["foreign_keys"], len(serial["foreign_keys"]))
+        self.assertEqual(len(report["slowest_schemas"]), 3)
+
+        # schemas are timed as well when each worker builds a single schema
+        profiler = Profiler()
+        compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, profiler=profiler, jobs=15)
+        self.assertEqual(compiler.compile(), serial)
+        self.assertEqual(len(profiler.report()["slowest_schemas"]), 10)
+
+        profiler = Profiler(top_schemas=0)
+        Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, profiler=profiler).compile()
+        self.assertEqual(len(profiler.report()["slowest_schemas"]), 15)
+
+    def test_compile_relationship_graph(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY)
+        obj = compiler.compile()
+
+        graph = compiler.relationship_graph
+        self.assertEqual(graph.many_to_many, [("User", "Role")])
+        self.assertEqual(list(obj["many_to_many"].keys()), ["roles_users"])
+        self.assertEqual(sorted(obj["foreign_keys"].keys()), sorted(a + "." + b for a, b in graph.edges.keys()))
+        self.assertEqual(list(graph.get_edges("Shopper").keys()), [("Shopper", "Wallet")])
+        # the edges of each model are kept up to date as resolve() removes edges
+        for model_name in obj["models"]:
+            self.assertEqual(list(graph.get_edges(model_name).keys()),
+                             [edge for edge in graph.edges.keys() if model_name in edge])
+        self.assertFalse(any("Role" in edge for edge in graph.get_edges("User")))
+
+        # overriding a one-to-many relationship drops its foreign key in favor of an association table
+        options["OVERRIDE_MANY_TO_MANY"].append({"model1": "Employee", "model2": "Store"})
+        obj = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY).compile()
+        self.assertFalse("Store.Employee" in obj["foreign_keys"])
+        self.assertEqual(list(obj["many_to_many"].keys()), ["employees_stores", "roles_users"])
+
     def test_compile_verify_nested(self):
         options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
         compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY, output=self.GROCERY_TMP)
@@ -122,6 +255,8 @@ class TestCompiler(TestCase):
         self.assertEqual(obj["schemas"]["EmployeeSchema"]["nested"]["favBanana"]["many"], False)
         self.assertEqual(obj["schemas"]["EmployeeSchema"]["nested"]["favApples"]["schema"], "AppleSchema")
         self.assertEqual(obj["schemas"]["EmployeeSchema"]["nested"]["favApples"]["many"], True)
+        self.assertEqual(obj["model_resources"]["Employee"], "Employee")
+        self.assertEqual(obj["resources"][obj["model_resources"]["Banana"]]["schema"], "BananaSchema")
 
     def test_compile_verify_enum(self):
         options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
@@ -1,6 +1,9 @@
 import os
-from unittest import TestCase
+import shutil
+import tempfile
+from unittest import TestCase, mock
 
+import mechanic.src.utils as utils
 from mechanic.src.reader import read_mechanicfile
 
 
@@ -12,3 +15,58 @@ class TestFileParsing(TestCase):
         self.assertEqual(options.get("APP_NAME"), "grocery")
         self.assertEqual(options.get("OVERRIDE_BASE_CONTROLLER")[0].get("with"), "abc.mypackage.hello.MyController")
         self.assertEqual(options.get("OVERRIDE_BASE_CONTROLLER")[0].get("for")[0], "controllers.default.GroceriesItemController")
+
+    def test_parse_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with mock.patch.dict(os.environ, {"MECHANIC_CACHE_DIR": cache_dir}):
+                spec = os.path.dirname(__file__) + "/specs/petstore.yaml"
+                parsed = utils.deserialize_file(spec)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+                cached = utils.deserialize_file(spec)
+                self.assertEqual(cached, parsed)
+                self.assertIsNot(cached, parsed)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_parse_cache_prune(self):
+        cache_dir = tempfile.mkdtemp()
+        original_max_size = utils.PARSE_CACHE_MAX_SIZE
+        try:
+            with mock.patch.dict(os.environ, {"MECHANIC_CACHE_DIR": cache_dir}):
+                specs = []
+                for name in ["a", "b", "c"]:
+                    specs.append(cache_dir + "/%s.yaml" % name)
+                    with open(specs[-1], "w") as f:
+                        f.write("info:\n  title: %s\n" % name)
+
+                def cache_file(spec):
+                    with open(spec, "rb") as f:
+                        return utils._get_parse_cache_file(spec, f.read())
+
+                utils.deserialize_file(specs[0])
+                utils.deserialize_file(specs[1])
+                os.utime(cache_file(specs[0]), ns=(1000, 1000))
+                os.utime(cache_file(specs[1]), ns=(2000, 2000))
+                # room for 2 entries once pruned, the third one goes over the limit
+                utils.PARSE_CACHE_MAX_SIZE = int(os.path.getsize(cache_file(specs[0])) * 2.8)
+
+                # reading 'a' makes it the most recently used, so 'b' is removed when 'c' is added
+                utils.deserialize_file(specs[0])
+                utils.deserialize_file(specs[2])
+                self.assertTrue(os.path.exists(cache_file(specs[0])))
+                self.assertFalse(os.path.exists(cache_file(specs[1])))
+                self.assertTrue(os.path.exists(cache_file(specs[2])))
+        finally:
+            utils.PARSE_CACHE_MAX_SIZE = original_max_size
+            shutil.rmtree(cache_dir)
+
+    def test_replace_template_var(self):
+        self.assertEqual(utils.replace_template_var("schemas/v{{version}}/{{ namespace }}.py",
+                                                    version="100",
+                                                    namespace="default"), "schemas/v100/default.py")
+        self.assertEqual(utils.replace_template_var("{{resource}}{{controller_type}}Controller",
+                                                    resource="Pet"), "PetController")
+        self.assertEqual(utils.replace_template_var("{{resource|lower}}s", resource="Pet"), "pets")
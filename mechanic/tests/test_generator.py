@@ -1,12 +1,17 @@
 import os
-from unittest import TestCase
+import copy
+import json
+import tempfile
+from unittest import TestCase, mock
 import shutil
 
+from mechanic.src import build, templates, utils
 from mechanic.src.compiler import Compiler
-from mechanic.src.generator import Generator
+from mechanic.src.generator import Generator, GENERATED_AT_REGEX
 from mechanic.src.reader import read_mechanicfile, \
     OPENAPI3_FILE_KEY, APP_NAME_KEY, OVERRIDE_BASE_CONTROLLER_KEY, \
     MODELS_PATH_KEY, SCHEMAS_PATH_KEY, CONTROLLERS_PATH_KEY
+from mechanic.src.utils import deserialize_file
 
 
 class TestPetstore(TestCase):
@@ -31,7 +36,7 @@ class TestPetstore(TestCase):
         for item in os.listdir(os.path.dirname(__file__) + "/gen"):
             if os.path.isdir(os.path.realpath("gen/" + item)):
                 shutil.rmtree(os.path.realpath("gen/" + item))
-            elif item == "run.py" or item == "requirements.txt":
+            elif item in ["run.py", "requirements.txt", ".mechanic-assets.json"]:
                 os.remove(os.path.realpath("gen/" + item))
 
     def test_directory_structure(self):
@@ -45,3 +50,144 @@ class TestPetstore(TestCase):
 
         self.assertTrue(os.path.exists(self.CURRENT_DIR + "/gen/models/default.py"))
         self.assertTrue(os.path.exists(self.CURRENT_DIR + "/gen/schemas/v100/default.py"))
+
+    def test_generate_unchanged_files(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY)
+        compiler.compile()
+
+        gen = Generator(self.CURRENT_DIR + "/gen", compiler.mech_obj, options=options)
+        gen.generate()
+        self.assertEqual(gen.count_written_files(), len(gen.file_changes))
+
+        with open(self.CURRENT_DIR + "/gen/models/default.py", "a") as f:
+            f.write("# edited\n")
+
+        written_files = list(gen.file_changes)
+        gen = Generator(self.CURRENT_DIR + "/gen", compiler.mech_obj, options=options)
+        gen.generate()
+        self.assertEqual([path for path, changed in gen.file_changes.items() if changed], ["models/default.py"])
+        # files that did not change, including the __init__.py files created by the first build, are all counted
+        self.assertEqual(sorted(gen.file_changes), sorted(written_files))
+        with open(self.CURRENT_DIR + "/gen/models/default.py") as f:
+            self.assertFalse("# edited" in f.read())
+
+    def test_generate_unchanged_assets(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY)
+        compiler.compile()
+        gen_dir = self.CURRENT_DIR + "/gen"
+
+        def generate():
+            gen = Generator(gen_dir, compiler.mech_obj, options=options, oapi_obj=compiler.oapi_obj)
+            gen.generate()
+            return [path for path, changed in gen.file_changes.items() if changed]
+
+        written = generate()
+        self.assertTrue("grocery/static/js/lib/swagger/swagger-ui-bundle.js" in written)
+        self.assertTrue("mechanic/base/__init__.py" in written)
+        self.assertTrue(os.path.exists(gen_dir + "/mechanic/__init__.py"))
+        self.assertEqual(generate(), [])
+
+        # modified static files are kept, modified runtime files are rendered again, and deleted files come back
+        with open(gen_dir + "/grocery/static/css/lib/swagger/swagger-ui.css", "w") as f:
+            f.write("body {}")
+        with open(gen_dir + "/mechanic/base/schemas.py", "a") as f:
+            f.write("# edited\n")
+        os.remove(gen_dir + "/mechanic/base/exceptions.py")
+        os.remove(gen_dir + "/models/__init__.py")
+
+        self.assertEqual(sorted(generate()), ["mechanic/base/exceptions.py", "mechanic/base/schemas.py",
+                                              "models/__init__.py"])
+        with open(gen_dir + "/grocery/static/css/lib/swagger/swagger-ui.css") as f:
+            self.assertEqual(f.read(), "body {}")
+
+        # without a manifest, static files that are copies of mechanic's files are recorded, and the others copied again
+        os.remove(gen_dir + "/.mechanic-assets.json")
+        self.assertEqual(generate(), ["grocery/static/css/lib/swagger/swagger-ui.css"])
+        with open(gen_dir + "/.mechanic-assets.json") as f:
+            assets = json.load(f)["assets"]
+        self.assertTrue(all(entry["key"] for entry in assets.values()))
+        self.assertEqual(generate(), [])
+
+    def test_generate_unchanged_docs(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        compiler = Compiler(options, mechanic_file_path=self.MECHANIC_BUILD_FILE_GROCERY)
+        compiler.compile()
+        docs_file = self.CURRENT_DIR + "/gen/grocery/static/docs.yaml"
+
+        def generate():
+            gen = Generator(self.CURRENT_DIR + "/gen", compiler.mech_obj, options=options, oapi_obj=compiler.oapi_obj)
+            with mock.patch.object(utils, "serialize_to_string", wraps=utils.serialize_to_string) as dump:
+                gen.generate()
+            return dump.call_count, gen.file_changes["grocery/static/docs.yaml"]
+
+        self.assertEqual(generate(), (1, True))
+        # the spec did not change, so it is not dumped to yaml again
+        self.assertEqual(generate(), (0, False))
+
+        compiler.oapi_obj["info"]["title"] = "Corner Shop"
+        self.assertEqual(generate(), (1, True))
+        with open(docs_file) as f:
+            self.assertTrue("Corner Shop" in f.read())
+
+        os.remove(docs_file)
+        self.assertEqual(generate(), (1, True))
+
+    def test_generate_in_memory(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        options[OPENAPI3_FILE_KEY] = None
+
+        mech_obj, files = build.generate(deserialize_file(self.GROCERY_SPEC), options)
+
+        self.assertTrue("Groceries" in mech_obj["models"])
+        self.assertTrue("class Groceries(" in files["models/default.py"])
+        self.assertTrue("schemas/v100/__init__.py" in files)
+        # the __init__.py files of the copied mechanic package are not replaced by empty ones
+        self.assertFalse("mechanic/utils/__init__.py" in files)
+        self.assertFalse("mechanic/base/__init__.py" in files)
+        self.assertTrue("GroceriesItemController" in files["grocery/init_api.py"])
+        self.assertTrue(files["grocery/static/docs.yaml"].startswith("openapi:"))
+        self.assertEqual(sorted(os.listdir(self.CURRENT_DIR + "/gen")),
+                         ["mechanic-grocery.json", "mechanic-petstore.json"])
+
+        mech_obj = build.compile_spec(deserialize_file(self.GROCERY_SPEC), options)
+        self.assertEqual(mech_obj["controllers"]["GroceriesItemController"]["base_controller_name"], "MyController")
+
+    def test_generate_parallel_matches_serial(self):
+        options = read_mechanicfile(self.MECHANIC_BUILD_FILE_GROCERY)
+        options[OPENAPI3_FILE_KEY] = None
+        spec = deserialize_file(self.GROCERY_SPEC)
+        # the groceries controllers move their models to another namespace
+        for path in ["/groceries", "/groceries/{gId}"]:
+            spec["paths"][path]["x-mechanic-namespace"] = "store"
+
+        mech_obj, serial = build.generate(copy.deepcopy(spec), options)
+        self.assertEqual(mech_obj["namespaces"]["store"]["models"], ["GroceryItem", "Groceries"])
+        self.assertFalse("Groceries" in mech_obj["namespaces"]["default"]["models"])
+
+        mech_obj, parallel = build.generate(copy.deepcopy(spec), options, jobs=2)
+        self.assertEqual(list(parallel.keys()), list(serial.keys()))
+        for path, contents in serial.items():
+            self.assertEqual(GENERATED_AT_REGEX.sub("", parallel[path]), GENERATED_AT_REGEX.sub("", contents))
+        self.assertTrue("class Groceries(" in parallel["models/store.py"])
+
+    def test_render_shared_environment(self):
+        tpl_path = self.CURRENT_DIR + "/../templates/init_models.tpl"
+        environment = templates.get_environment()
+
+        result = templates.render(tpl_path, {"module_paths": {"models.default": ["Pet"]}})
+        self.assertEqual(result, "\nfrom models.default import (Pet, )")
+        self.assertIs(templates.get_environment(), environment)
+        self.assertIs(environment.get_template(os.path.abspath(tpl_path)),
+                      environment.get_template(os.path.abspath(tpl_path)))
+
+    def test_render_bytecode_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            bytecode_cache = templates.BytecodeCache(cache_dir + "/templates")
+            environment = templates.jinja2.Environment(loader=templates.PathLoader(), bytecode_cache=bytecode_cache)
+            environment.get_template(os.path.abspath(self.CURRENT_DIR + "/../templates/models.tpl"))
+            self.assertEqual(len(os.listdir(cache_dir + "/templates")), 1)
+        finally:
+            shutil.rmtree(cache_dir)
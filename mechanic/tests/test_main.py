@@ -0,0 +1,75 @@
+import os
+import re
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+
+class TestMain(TestCase):
+    """
+    Guards the startup path of the mechanic command: which modules importing it pulls in, and a loose bound on how long
+    that takes.
+    """
+    ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # third party modules that take long to import, and are only needed by some of the commands
+    SLOW_IMPORTS = ["inflect", "jinja2", "yaml", "pkg_resources"]
+
+    def _import(self, statement):
+        """
+        Runs an import statement in a fresh interpreter.
+        :return: names of the modules that were imported, and the time the import took in seconds
+        """
+        code = "import sys, time\n" \
+               "start = time.perf_counter()\n" \
+               "%s\n" \
+               "print(time.perf_counter() - start)\n" \
+               "print(' '.join(sys.modules))" % statement
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=self.ROOT, universal_newlines=True)
+        import_time, modules = output.splitlines()
+        return modules.split(), float(import_time)
+
+    def test_import_main(self):
+        modules, import_time = self._import("import mechanic.main")
+
+        for module in self.SLOW_IMPORTS + ["mechanic.src.compiler", "mechanic.src.generator", "mechanic.src.merger"]:
+            self.assertFalse(module in modules, "'import mechanic.main' imports %s (took %.3fs)" % (module, import_time))
+        # importing inflect alone takes seconds, the bound is loose enough for slow machines.
+        self.assertTrue(import_time < 1.0, "'import mechanic.main' took %.3fs" % import_time)
+
+    def test_build_jobs_matches_serial(self):
+        spec_dir = self.ROOT + "/mechanic/tests/specs"
+        outputs = []
+        for jobs in ["1", "2"]:
+            work_dir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, work_dir)
+            shutil.copy(spec_dir + "/grocery.yaml", work_dir)
+            with open(work_dir + "/mechanic.json", "w") as f:
+                json.dump({"OPENAPI": "grocery.yaml", "APP_NAME": "grocery"}, f)
+
+            subprocess.check_output([sys.executable, "-m", "mechanic.main", "build", work_dir, "--jobs=" + jobs],
+                                    cwd=self.ROOT)
+
+            files = dict()
+            for dir_path, dir_names, file_names in os.walk(work_dir):
+                for file_name in file_names:
+                    with open(os.path.join(dir_path, file_name), "rb") as f:
+                        contents = f.read()
+                    files[os.path.relpath(os.path.join(dir_path, file_name), work_dir)] = \
+                        re.sub(rb"generated code at UTC [^#\n]*", b"", contents)
+            outputs.append(files)
+
+        self.assertTrue("models/default.py" in outputs[0])
+        self.assertEqual(sorted(outputs[0]), sorted(outputs[1]))
+        for path in outputs[0]:
+            if path != ".mechanic-assets.json":
+                self.assertEqual(outputs[0][path], outputs[1][path], path)
+
+    def test_import_compiler(self):
+        modules, import_time = self._import("import mechanic.src.compiler")
+
+        for module in ["inflect", "jinja2", "mechanic.src.generator"]:
+            self.assertFalse(module in modules,
+                             "'import mechanic.src.compiler' imports %s (took %.3fs)" % (module, import_time))
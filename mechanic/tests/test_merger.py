@@ -0,0 +1,243 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mechanic.src.cache import DocumentCache
+from mechanic.src.merger import Merger, SpecMerger
+from mechanic.src.utils import deserialize_file
+
+
+class TestMerger(TestCase):
+    SPLIT_SPEC = os.path.dirname(__file__) + "/specs/split/garage.yaml"
+    SPLIT_TMP = os.path.dirname(__file__) + "/tmp-garage.yaml"
+    PARKING_SPEC = os.path.dirname(__file__) + "/specs/split/parking.yaml"
+    MASTER_TMP = os.path.dirname(__file__) + "/tmp-master.json"
+
+    def tearDown(self):
+        for tmp in [self.SPLIT_TMP, self.MASTER_TMP]:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+
+    def _spec_merge(self, jobs=1, remove_keys=None):
+        with open(self.MASTER_TMP, "w") as f:
+            f.write('{"openapi": "3.0.0", "info": {"version": "1.0.0", "title": "Master"}}')
+
+        SpecMerger([self.SPLIT_SPEC, self.PARKING_SPEC], self.MASTER_TMP, jobs=jobs).merge(remove_keys=remove_keys)
+        return deserialize_file(self.MASTER_TMP)
+
+    def test_merge_external_refs(self):
+        merger = Merger(self.SPLIT_SPEC, self.SPLIT_TMP)
+        merger.merge()
+
+        schemas = merger.oapi_obj["components"]["schemas"]
+        self.assertEqual(list(schemas.keys()), ["Garage", "Car", "Wheel", "Tire"])
+        self.assertEqual(schemas["Garage"]["properties"]["cars"]["items"]["$ref"], "#/components/schemas/Car")
+        self.assertEqual(schemas["Car"]["properties"]["wheels"]["items"]["$ref"], "#/components/schemas/Wheel")
+        self.assertEqual(schemas["Wheel"]["properties"]["tire"]["$ref"], "#/components/schemas/Tire")
+
+        schema = merger.oapi_obj["paths"]["/cars"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        self.assertEqual(schema["$ref"], "#/components/schemas/Car")
+
+    def test_merge_remote_refs(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            shutil.copytree(os.path.dirname(self.SPLIT_SPEC), work_dir + "/split")
+            spec_file = work_dir + "/split/garage.yaml"
+            with open(spec_file) as f:
+                contents = f.read()
+            with open(spec_file, "w") as f:
+                f.write(contents.replace("        name:\n", "        owner:\n"
+                                         "          $ref: \"https://example.com/common.yaml#/Owner\"\n"
+                                         "        name:\n", 1))
+
+            for jobs in [1, 2]:
+                merger = Merger(spec_file, None, jobs=jobs)
+                merger.merge()
+
+                garage = merger.oapi_obj["components"]["schemas"]["Garage"]
+                self.assertEqual(garage["properties"]["owner"]["$ref"], "https://example.com/common.yaml#/Owner")
+                self.assertEqual(garage["properties"]["cars"]["items"]["$ref"], "#/components/schemas/Car")
+                self.assertFalse(any("example.com" in path for path in merger.referenced_files()))
+        finally:
+            shutil.rmtree(work_dir)
+
+    def test_merge_reference_cycles(self):
+        merger = Merger(self.SPLIT_SPEC, self.SPLIT_TMP)
+        merger.merge()
+
+        self.assertEqual(merger.reference_cycles, [["cars.yaml#/Car", "parts/wheel.yaml#/Wheel", "cars.yaml#/Car"]])
+        self.assertEqual(merger.reference_graph["#"], ["cars.yaml#/Car"] * 3)
+
+    def test_merge_pointer_index(self):
+        merger = Merger(self.SPLIT_SPEC, self.SPLIT_TMP)
+        merger.merge()
+
+        schemas = merger.oapi_obj["components"]["schemas"]
+        obj, name = merger.follow_reference_link("#/components/schemas/Car")
+        self.assertIs(obj, schemas["Car"])
+        self.assertEqual(name, "Car")
+
+        index = merger.pointer_index
+        self.assertIs(index.resolve("#/components/schemas/Car/properties/wheels/items"),
+                      schemas["Car"]["properties"]["wheels"]["items"])
+        self.assertEqual(index.resolve("#/paths/~1cars~1{carId}/get/summary"), "Get a car")
+        self.assertTrue("#/components/schemas/Wheel/properties/tire" in index)
+
+        with self.assertRaises(SyntaxError) as e:
+            index.resolve("#/components/schemas/Car/properties/color")
+        self.assertTrue("'#/components/schemas/Car/properties' has no item 'color'" in str(e.exception))
+
+    def test_merge_shared_document_cache(self):
+        cache = DocumentCache()
+        Merger(self.SPLIT_SPEC, self.SPLIT_TMP, document_cache=cache).merge()
+        self.assertEqual(cache.stats(), {"documents": 2, "hits": 1, "misses": 2, "evictions": 0})
+
+        merger = Merger(self.SPLIT_SPEC, self.SPLIT_TMP, document_cache=cache)
+        merger.merge()
+        self.assertEqual(cache.hits, 4)
+        self.assertEqual(cache.misses, 2)
+
+        # objects handed out by the cache are copies, so merging must not rewrite the cached documents.
+        cars = cache.load(os.path.dirname(self.SPLIT_SPEC) + "/cars.yaml")
+        self.assertEqual(cars["Car"]["properties"]["wheels"]["items"]["$ref"], "parts/wheel.yaml#/Wheel")
+
+    def test_document_cache_eviction(self):
+        cache = DocumentCache(max_size=1)
+        Merger(self.SPLIT_SPEC, self.SPLIT_TMP, document_cache=cache).merge()
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.evictions, 2)
+
+    def test_merge_parallel_matches_serial(self):
+        serial = Merger(self.SPLIT_SPEC, self.SPLIT_TMP)
+        serial.merge()
+
+        cache = DocumentCache()
+        parallel = Merger(self.SPLIT_SPEC, self.SPLIT_TMP, document_cache=cache, jobs=2)
+        parallel.merge()
+
+        self.assertEqual(parallel.oapi_obj, serial.oapi_obj)
+        self.assertEqual(list(parallel.oapi_obj["components"]["schemas"].keys()),
+                         list(serial.oapi_obj["components"]["schemas"].keys()))
+        self.assertEqual(cache.misses, 0)
+
+    def test_spec_merge_in_memory(self):
+        merged = self._spec_merge()
+
+        self.assertEqual(list(merged["paths"].keys()), ["/cars", "/cars/{carId}", "/spots"])
+        self.assertEqual(list(merged["components"]["schemas"].keys()), ["Garage", "Car", "Wheel", "Tire", "Spot"])
+        self.assertFalse(os.path.exists("tmp_merged_specs"))
+
+    def test_spec_merge_parallel_matches_serial(self):
+        self.assertEqual(self._spec_merge(jobs=2), self._spec_merge(jobs=1))
+
+    def test_spec_merge_strips_extensions(self):
+        merged = self._spec_merge()
+
+        spot = merged["components"]["schemas"]["Spot"]
+        self.assertEqual(list(spot["properties"].keys()), ["number", "car"])
+        self.assertFalse(spot["properties"]["number"].get("x-mechanic-db"))
+        self.assertFalse(spot.get("x-mechanic-public"))
+        self.assertEqual(spot["x-mechanic-namespace"], "parking")
+        self.assertFalse(merged["paths"]["/spots"].get("x-mechanic-controller"))
+        self.assertFalse(merged["paths"]["/spots"].get("x-mechanic-tags"))
+
+    def test_spec_merge_custom_remove_keys(self):
+        merged = self._spec_merge(remove_keys=["x-mechanic-namespace"])
+
+        spot = merged["components"]["schemas"]["Spot"]
+        self.assertFalse(spot.get("x-mechanic-namespace"))
+        self.assertTrue(spot.get("x-mechanic-public"))
+        self.assertEqual(merged["paths"]["/spots"]["x-mechanic-tags"], ["parking"])
+        self.assertFalse("lotCode" in spot["properties"])
+
+    def test_spec_merge_compact(self):
+        merged = self._spec_merge()
+
+        with open(self.MASTER_TMP, "w") as f:
+            f.write('{"openapi": "3.0.0", "info": {"version": "1.0.0", "title": "Master"}}')
+        SpecMerger([self.SPLIT_SPEC, self.PARKING_SPEC], self.MASTER_TMP, compact=True).merge()
+
+        with open(self.MASTER_TMP) as f:
+            contents = f.read()
+        self.assertFalse("\n" in contents or ": " in contents)
+        self.assertEqual(deserialize_file(self.MASTER_TMP), merged)
+
+    def test_spec_merge_incremental(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            shutil.copytree(os.path.dirname(self.SPLIT_SPEC), work_dir + "/split")
+            inputs = [work_dir + "/split/garage.yaml", work_dir + "/split/parking.yaml"]
+            master = work_dir + "/master.json"
+
+            def spec_merge():
+                with open(master, "w") as f:
+                    f.write('{"openapi": "3.0.0", "info": {"version": "1.0.0", "title": "Master"}}')
+                spec_merger = SpecMerger(inputs, master, incremental=True)
+                spec_merger.merge()
+                return spec_merger.stale_files, deserialize_file(master)
+
+            stale, merged = spec_merge()
+            self.assertEqual(stale, inputs)
+
+            stale, merged_again = spec_merge()
+            self.assertEqual(stale, [])
+            self.assertEqual(merged_again, merged)
+
+            with open(inputs[0]) as f:
+                contents = f.read()
+            with open(inputs[0], "w") as f:
+                f.write(contents.replace("  schemas:\n", "  schemas:\n    Shed:\n      type: object\n"))
+            stale, merged = spec_merge()
+            self.assertEqual(stale, inputs[:1])
+            self.assertTrue("Shed" in merged["components"]["schemas"])
+
+            # both input specs reference Wheel through Car
+            with open(work_dir + "/split/parts/wheel.yaml", "a") as f:
+                f.write("    color:\n      type: string\n")
+            stale, merged = spec_merge()
+            self.assertEqual(stale, inputs)
+        finally:
+            shutil.rmtree(work_dir)
+
+    def test_spec_merge_incremental_keep_artifacts(self):
+        work_dir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            shutil.copytree(os.path.dirname(self.SPLIT_SPEC), work_dir + "/split")
+            inputs = [work_dir + "/split/garage.yaml", work_dir + "/split/parking.yaml"]
+            master = work_dir + "/master.json"
+            os.chdir(work_dir)
+
+            def spec_merge():
+                with open(master, "w") as f:
+                    f.write('{"openapi": "3.0.0", "info": {"version": "1.0.0", "title": "Master"}}')
+                spec_merger = SpecMerger(inputs, master, keep_artifacts=True, incremental=True)
+                spec_merger.merge()
+                artifacts = dict((name, deserialize_file("tmp_merged_specs/" + name))
+                                 for name in os.listdir("tmp_merged_specs"))
+                return spec_merger.stale_files, artifacts
+
+            stale, artifacts = spec_merge()
+            self.assertEqual(stale, inputs)
+            self.assertEqual(sorted(artifacts), ["0.yaml", "1.yaml"])
+
+            # the artifacts of input specs loaded from their saved copy are kept
+            stale, artifacts_again = spec_merge()
+            self.assertEqual(stale, [])
+            self.assertEqual(artifacts_again, artifacts)
+
+            with open(inputs[0]) as f:
+                contents = f.read()
+            with open(inputs[0], "w") as f:
+                f.write(contents.replace("  schemas:\n", "  schemas:\n    Shed:\n      type: object\n"))
+            stale, artifacts_again = spec_merge()
+            self.assertEqual(stale, inputs[:1])
+            self.assertTrue("Shed" in artifacts_again["0.yaml"]["components"]["schemas"])
+            self.assertEqual(artifacts_again["1.yaml"], artifacts["1.yaml"])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir)
@@ -0,0 +1,57 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mechanic.src.watcher import Watcher
+
+
+class TestWatcher(TestCase):
+    SPLIT_DIR = os.path.dirname(__file__) + "/specs/split"
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        shutil.copytree(self.SPLIT_DIR, self.work_dir + "/split")
+        with open(self.work_dir + "/mechanic.json", "w") as f:
+            json.dump({"OPENAPI": "split/garage.yaml", "APP_NAME": "garage"}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _edit(self, path, contents):
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "w") as f:
+            f.write(contents)
+        # make sure the change is seen even if the file system has a coarse timestamp resolution
+        os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+    def test_watch_rebuilds_on_change(self):
+        watcher = Watcher(self.work_dir, self.work_dir + "/mechanic.json")
+        result = watcher.build()
+        self.assertFalse(result.get("error"))
+        self.assertEqual(len(result["stale_schemas"]), 4)
+        self.assertTrue(os.path.exists(self.work_dir + "/models/default.py"))
+        self.assertTrue(self.work_dir + "/split/parts/wheel.yaml" in watcher.watched_files)
+        self.assertEqual(watcher.poll(), None)
+
+        wheel_file = self.work_dir + "/split/parts/wheel.yaml"
+        with open(wheel_file) as f:
+            contents = f.read()
+        self._edit(wheel_file, contents + "    color:\n      type: string\n")
+        result = watcher.poll()
+        self.assertEqual(result["changed_files"], [wheel_file])
+        # Car references Wheel, so it is compiled again as well
+        self.assertEqual(sorted(result["stale_schemas"]), ["Car", "Wheel"])
+        self.assertTrue(result["written_files"] > 0)
+        with open(self.work_dir + "/models/default.py") as f:
+            self.assertTrue("color" in f.read())
+
+        # a broken file fails the build, and the next change builds again
+        self._edit(wheel_file, contents + "  bad: [\n")
+        result = watcher.poll()
+        self.assertTrue("rebuild failed" in watcher.format_result(result))
+        self._edit(wheel_file, contents)
+        result = watcher.poll()
+        self.assertFalse(result.get("error"))
+        self.assertEqual(sorted(result["stale_schemas"]), ["Car", "Wheel"])